@@ -0,0 +1,35 @@
+"""
+Настройки gunicorn.
+
+Приложение загружается в главном процессе до запуска воркеров (preload_app):
+Django, модели, URLconf и представления импортируются один раз, воркеры
+получают их при fork готовыми и делят с главным процессом страницы памяти.
+
+ASGI: gunicorn sigvard.asgi:application -k uvicorn_worker.UvicornWorker
+WSGI: gunicorn sigvard.wsgi:application
+"""
+
+import gc
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8080")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+preload_app = True
+
+
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+
+    from django.urls import get_resolver
+
+    from storage.db_pool import close_pools
+
+    # Представления, формы и шаблонные теги загружаются до запуска воркеров
+    get_resolver().url_patterns
+    # Соединения с БД не должны достаться воркерам: каждый воркер
+    # открывает свои при первом запросе
+    close_pools()
+    # Объекты, созданные при загрузке, больше не просматриваются сборщиком
+    # мусора: иначе его проход в воркере копировал бы общие страницы памяти
+    gc.freeze()
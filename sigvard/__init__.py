@@ -1,3 +1,11 @@
-from .celery import app as celery_app
-
 __all__ = ("celery_app",)
+
+
+def __getattr__(name):
+    # Приложение Celery загружается при первом обращении (его импортируют
+    # модуль задач и команда celery), а не при каждом запуске Django
+    if name == "celery_app":
+        from .celery import app
+
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -23,27 +23,40 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
-    "debug_toolbar",
     "phonenumber_field",
     "storage",
 ]
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "storage.staticfiles.StaticFilesMiddleware",
+    "storage.profiling.RequestProfilingMiddleware",
+    "storage.routers.ReplicaRoutingMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
 ]
 
+# Панель отладки только для разработки: в production она замедляет
+# каждый запрос, замеры там делает storage.profiling
+if DEBUG:
+    INSTALLED_APPS.append("debug_toolbar")
+    MIDDLEWARE.append("debug_toolbar.middleware.DebugToolbarMiddleware")
+
+# Доля запросов, замеры которых пишутся в лог
+PROFILING_SAMPLE_RATE = env.float("PROFILING_SAMPLE_RATE", 0.01)
+# Запросы дольше этого времени пишутся в лог всегда, с самыми долгими SQL-запросами
+PROFILING_SLOW_REQUEST_MS = env.int("PROFILING_SLOW_REQUEST_MS", 500)
+
 ROOT_URLCONF = "sigvard.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # DjangoTemplates с замером времени рендеринга (см. storage.profiling)
+        "BACKEND": "storage.profiling.ProfiledDjangoTemplates",
         "DIRS": [
             os.path.join(BASE_DIR, "templates"),
         ],
@@ -70,6 +83,47 @@ DATABASES = {
     )
 }
 
+# Реплики только для чтения, через запятую. Читают с них только веб-запросы
+# (см. storage.routers), задачи Celery и команды работают с основной БД
+DATABASE_REPLICAS = []
+for index, url in enumerate(env.list("DATABASE_REPLICA_URLS", [])):
+    alias = f"replica_{index}"
+    DATABASES[alias] = {**dj_database_url.parse(url), "TEST": {"MIRROR": "default"}}
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ["storage.routers.PrimaryReplicaRouter"]
+
+# Пул соединений psycopg 3 в каждом процессе gunicorn и Celery. Размер
+# задается отдельно для веб-процессов и воркеров (см. docker-compose.yml)
+DATABASE_POOL = {
+    "min_size": env.int("DATABASE_POOL_MIN_SIZE", 1),
+    "max_size": env.int("DATABASE_POOL_MAX_SIZE", 4),
+    # Сколько секунд ждать свободного соединения
+    "timeout": env.float("DATABASE_POOL_TIMEOUT", 10),
+    "max_idle": 5 * 60,
+    "max_lifetime": 60 * 60,
+}
+
+
+def get_database_pool_options() -> dict:
+    """
+    Параметры ConnectionPool. Соединение проверяется перед выдачей из пула
+    (check): с пулом Django не выполняет CONN_HEALTH_CHECKS, а psycopg_pool
+    по умолчанию выдает соединения без проверки, и после переключения БД
+    или обрыва простаивающего соединения запрос получил бы мертвое
+    """
+    from psycopg_pool import ConnectionPool
+
+    return {**DATABASE_POOL, "check": ConnectionPool.check_connection}
+
+
+for database in DATABASES.values():
+    if database["ENGINE"] == "django.db.backends.postgresql":
+        database["CONN_MAX_AGE"] = 0
+        database.setdefault("OPTIONS", {})["pool"] = get_database_pool_options()
+# Сколько секунд после записи пользователь читает из основной БД,
+# и сколько после изменения версии кэша записи пересчитываются по ней
+DATABASE_REPLICA_MAX_LAG = env.int("DATABASE_REPLICA_MAX_LAG", 10)
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -86,8 +140,9 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# UserEmailBackend наследует ModelBackend и принимает как email, так и username,
+# поэтому отдельный ModelBackend не нужен: он добавлял лишний запрос и хэширование
 AUTHENTICATION_BACKENDS = [
-    "django.contrib.auth.backends.ModelBackend",
     "storage.backends.UserEmailBackend",
 ]
 
@@ -110,6 +165,8 @@ USE_L10N = True
 USE_TZ = True
 
 INTERNAL_IPS = ["127.0.0.1"]
+# Адреса, с которых доступны метрики Celery (/metrics/)
+METRICS_ALLOWED_IPS = env.list("METRICS_ALLOWED_IPS", INTERNAL_IPS)
 
 # Media files
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
@@ -122,6 +179,16 @@ STATICFILES_DIRS = [
 ]
 STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    # Имена файлов с хэшем содержимого и сжатые копии (см. storage.staticfiles)
+    "staticfiles": {
+        "BACKEND": "storage.staticfiles.CompressedManifestStaticFilesStorage",
+    },
+}
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
@@ -135,6 +202,31 @@ CELERY_ACCEPT_CONTENT = ["application/json"]
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TASK_SERIALIZER = "json"
 CELERY_TIMEZONE = "Europe/Moscow"
+CELERY_BEAT_SCHEDULE = {
+    "sweep-rents": {
+        "task": "storage.tasks.sweep_rents_task",
+        "schedule": 5 * 60,
+    },
+    # Повторные попытки отправки писем из очереди
+    "send-outbox-emails": {
+        "task": "storage.tasks.send_outbox_emails_task",
+        "schedule": 60,
+    },
+}
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "storage": {"handlers": ["console"], "level": "INFO"},
+    },
+}
+
+# В тестах логгер storage пишет только предупреждения и ошибки
+TEST_RUNNER = "sigvard.test_runner.TestRunner"
 
 # Email settings
 EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
@@ -0,0 +1,19 @@
+import logging
+
+from django.test.runner import DiscoverRunner
+
+# Уровень логгера storage в тестах: замеры запросов (INFO) не выводятся
+# между точками прогресса. Тесты, которые проверяют записи, получают их
+# через assertLogs независимо от уровня
+TEST_LOG_LEVEL = logging.WARNING
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.storage_log_level = logging.getLogger("storage").level
+        logging.getLogger("storage").setLevel(TEST_LOG_LEVEL)
+
+    def teardown_test_environment(self, **kwargs):
+        logging.getLogger("storage").setLevel(self.storage_log_level)
+        super().teardown_test_environment(**kwargs)
@@ -1,9 +1,17 @@
-function loadBoxes(storageId) {
+function loadBoxes(storageId, cursor = null, loadedBoxes = []) {
+    // Список приходит постранично; браузер сам перепроверяет его по ETag
+    // и не скачивает заново, если боксы не менялись
     $.ajax({
         url: `/get_boxes/${storageId}/`,
         method: "GET",
+        data: cursor ? {cursor: cursor} : {},
         success: function (response) {
-            generatedBoxes(response.boxes)
+            const boxes = loadedBoxes.concat(response.boxes);
+            if (response.next) {
+                loadBoxes(storageId, response.next, boxes);
+            } else {
+                generatedBoxes(boxes);
+            }
         },
         error: function (xhr, status, error) {
             console.error("Ошибка загрузки данных:", error);
@@ -89,9 +97,10 @@ function createBoxElement(box) {
 
     boxElement.addEventListener('click', (event) => {
         event.preventDefault();
-        const boxField = document.querySelector('select[name="box"]');
-        boxField.value = box.id;
-        boxField.scrollIntoView({behavior: 'smooth', block: 'center'});
+        document.querySelector('input[name="box"]').value = box.id;
+        const selectedBox = document.querySelector('#selected-box');
+        selectedBox.textContent = `Бокс ${box.number}, ${box.area} м², от ${box.price} ₽`;
+        selectedBox.scrollIntoView({behavior: 'smooth', block: 'center'});
     });
 
 
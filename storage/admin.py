@@ -1,6 +1,114 @@
-from django.contrib import admin
+from datetime import datetime
 
-from .models import Storage, Box, Rent
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connections, models
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.http import HttpResponseRedirect
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .models import Storage, Box, Rent, RentStatusConflict, OutboxEmail
+
+# С какого размера таблицы в списке без фильтров показывается
+# оценка числа записей из статистики PostgreSQL вместо COUNT(*)
+ESTIMATED_COUNT_THRESHOLD = 10_000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор, который для списка без фильтров берет оценку числа записей
+    из pg_class.reltuples, а не считает все строки таблицы
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if not queryset.query.where and connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= ESTIMATED_COUNT_THRESHOLD:
+                return int(row[0])
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Список без точного подсчета всех записей таблицы
+    """
+
+    paginator = EstimatedCountPaginator
+    # Не считать все записи таблицы при поиске и фильтрах
+    show_full_result_count = False
+
+
+def truncate(value, kind) -> datetime:
+    if kind == "year":
+        return value.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+    if kind == "month":
+        return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_period(value, kind) -> datetime:
+    if kind == "year":
+        return value.replace(year=value.year + 1)
+    if kind == "month":
+        if value.month == 12:
+            return value.replace(year=value.year + 1, month=1)
+        return value.replace(month=value.month + 1)
+    return datetime.fromordinal(value.toordinal() + 1)
+
+
+class DateHierarchyQuerySet(models.QuerySet):
+    """
+    Queryset списка в админке, который строит навигацию по датам
+    проверками по индексу, а не SELECT DISTINCT по всей таблице.
+
+    Границы берутся из MIN и MAX поля, затем для каждого года, месяца или
+    дня между ними выполняется EXISTS по диапазону значений
+    """
+
+    def datetimes(self, field_name, kind, order="ASC", tzinfo=None):
+        bounds = self.aggregate(
+            first=models.Min(field_name), last=models.Max(field_name)
+        )
+        if bounds["first"] is None:
+            return []
+
+        current_timezone = tzinfo or timezone.get_current_timezone()
+        period = truncate(
+            timezone.localtime(bounds["first"], current_timezone).replace(tzinfo=None),
+            kind,
+        )
+        last = timezone.localtime(bounds["last"], current_timezone).replace(tzinfo=None)
+        periods = []
+        while period <= last:
+            period_end = next_period(period, kind)
+            start = timezone.make_aware(period, current_timezone)
+            end = timezone.make_aware(period_end, current_timezone)
+            if self.filter(
+                **{f"{field_name}__gte": start, f"{field_name}__lt": end}
+            ).exists():
+                periods.append(start)
+            period = period_end
+
+        return periods if order == "ASC" else periods[::-1]
+
+
+class DateHierarchyChangeList(ChangeList):
+    def get_queryset(self, request, exclude_parameters=None):
+        queryset = super().get_queryset(request, exclude_parameters)
+        return DateHierarchyQuerySet(
+            model=queryset.model, query=queryset.query, using=queryset.db
+        )
 
 
 @admin.register(Storage)
@@ -9,13 +117,83 @@ class StorageAdmin(admin.ModelAdmin):
 
 
 @admin.register(Box)
-class BoxAdmin(admin.ModelAdmin):
-    search_fields = ("box",)
+class BoxAdmin(LargeTableAdmin):
+    list_display = ("number", "storage", "level", "area", "price", "is_occupied")
+    list_select_related = ("storage",)
+    list_filter = ["is_occupied"]
+    # Поиск выполняет get_search_results, поле нужно для autocomplete_fields
+    search_fields = ("number",)
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Поиск по началу номера бокса (индекс по номеру) или по городу склада
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return (
+            queryset.filter(
+                Q(number__startswith=search_term)
+                | Q(storage__in=Storage.objects.filter(city__iexact=search_term))
+            ),
+            False,
+        )
 
 
 @admin.register(Rent)
-class RentAdmin(admin.ModelAdmin):
-    readonly_fields = ("total_price", "task_ids")
+class RentAdmin(LargeTableAdmin):
+    list_display = ("id", "box", "email", "status", "start_date", "end_date")
+    list_select_related = ("box__storage",)
+    readonly_fields = ("total_price", "reminder_days_sent", "overdue_reminded_at")
     raw_id_fields = ("user", "box")
     autocomplete_fields = ["user", "box"]
     list_filter = ["status"]
+    date_hierarchy = "end_date"
+    search_fields = ("email",)
+    search_help_text = "Номер бокса, город склада или начало email"
+
+    def get_changelist(self, request, **kwargs):
+        return DateHierarchyChangeList
+
+    def changeform_view(self, request, object_id=None, form_url="", extra_context=None):
+        """
+        Если статус аренды успели изменить параллельно (RentStatusConflict),
+        транзакция сохранения откатывается, а администратор возвращается
+        к форме с сообщением вместо ошибки 500
+        """
+        try:
+            return super().changeform_view(request, object_id, form_url, extra_context)
+        except RentStatusConflict as error:
+            self.message_user(
+                request,
+                f"{error}. Проверьте аренду и повторите изменение.",
+                messages.ERROR,
+            )
+            return HttpResponseRedirect(request.get_full_path())
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Поиск аренд по номеру бокса, городу склада или началу email.
+
+        Боксы выбираются отдельным подзапросом, а email сравнивается
+        с LOWER(email), поэтому оба условия используют индексы storage_rent
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        boxes = Box.objects.filter(
+            Q(number=search_term) | Q(storage__city__iexact=search_term)
+        ).values("pk")
+        return (
+            queryset.alias(email_lower=Lower("email")).filter(
+                Q(box__in=boxes) | Q(email_lower__startswith=search_term.lower())
+            ),
+            False,
+        )
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ("subject", "to", "status", "attempts", "created_at", "sent_at")
+    list_filter = ["status"]
+    readonly_fields = ("attempts", "last_error", "created_at", "sent_at")
@@ -1,27 +1,39 @@
 from django.contrib.auth.backends import ModelBackend, get_user_model
-from django.core.exceptions import MultipleObjectsReturned
 from django.db.models import Q
+from django.db.models.functions import Lower
 
 UserModel = get_user_model()
 
 
 class UserEmailBackend(ModelBackend):
     """
-    Переопределение авторизации
+    Переопределение авторизации: вход по email или имени пользователя.
+
+    Пользователь ищется одним запросом по username и LOWER(email), для
+    которого есть функциональный индекс, а пароль хэшируется ровно один раз
+    на каждую попытку входа
     """
 
     def authenticate(self, request, username=None, password=None, **kwargs):
-        try:
-            user = UserModel.objects.get(
-                Q(username=username) | Q(email__iexact=username)
-            )
-        except UserModel.DoesNotExist:
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
             return None
-        except MultipleObjectsReturned:
-            return UserModel.objects.filter(email=username).order_by("id").first()
-        else:
-            if user.check_password(password) and self.user_can_authenticate(user):
-                return user
+
+        user = (
+            UserModel._default_manager.annotate(email_lower=Lower("email"))
+            .filter(Q(username=username) | Q(email_lower=username.lower()))
+            .order_by("id")
+            .first()
+        )
+        if user is None:
+            # Хэшируем пароль и для несуществующего пользователя, чтобы
+            # по времени ответа нельзя было узнать, зарегистрирован ли email
+            UserModel().set_password(password)
+            return None
+
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
 
     def get_user(self, user_id):
         try:
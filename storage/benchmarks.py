@@ -0,0 +1,405 @@
+"""
+Замеры производительности представлений и задач.
+
+Каждый сценарий выполняется несколько раз через тестовый клиент Django
+на данных текущей базы (см. команду generate_synthetic_data). Для сценария
+записываются p50 и p95 времени ответа и наибольшее число SQL-запросов,
+результаты сравниваются с бюджетами из benchmark_budgets.json.
+
+Все сценарии выполняются в одной транзакции, которая откатывается в конце,
+поэтому созданные аренды и пользователи не остаются в базе. Функции
+on_commit, зарегистрированные сценарием, выполняются сразу после него, как
+после фиксации, и входят в замер. Задачи Celery выполняются синхронно,
+письма отправляются в память (locmem).
+
+Каждый сценарий получает свой кэш в памяти, рабочий кэш не затрагивается.
+Сценарий замеряется дважды: с прогретым кэшем (warm) и с кэшем, очищенным
+перед каждым запуском (cold).
+
+Время запуска (measure_startup) замеряется в отдельных процессах
+интерпретатора: каждый этап запускается заново с холодного старта.
+"""
+
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from pathlib import Path
+
+from celery import current_app
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Storage, Box, Rent
+from .tasks import send_outbox_emails_task, sweep_rents_task
+
+BUDGETS_PATH = Path(__file__).with_name("benchmark_budgets.json")
+BUDGET_KEYS = ("p50_ms", "p95_ms", "queries")
+CACHE_MODES = ("warm", "cold")
+# Рабочий кэш (Redis) не вытесняет записи, кэш сценария тоже не должен
+BENCHMARK_CACHE_MAX_ENTRIES = 1_000_000
+
+# Этапы запуска: код, который выполняется в новом процессе интерпретатора
+STARTUP_STAGES = {
+    "python": "pass",
+    "django.setup": "import django; django.setup()",
+    "wsgi": "import sigvard.wsgi",
+    "asgi": "import sigvard.asgi",
+    "urls": (
+        "import sigvard.wsgi; from django.urls import get_resolver; "
+        "get_resolver().url_patterns"
+    ),
+}
+# Модули, которые не должны загружаться при запуске веб-процесса
+# и команд manage.py: они нужны только для работы с задачами
+STARTUP_LAZY_MODULES = ("celery", "kombu", "redis")
+
+BENCHMARK_EMAIL = "benchmark@example.com"
+BENCHMARK_PASSWORD = "benchmark-password-7f3a"
+
+
+class BenchmarkError(Exception):
+    """
+    Сценарий вернул неожиданный ответ, замер не имеет смысла
+    """
+
+
+def percentile(values, percent) -> float:
+    """
+    Перцентиль методом ближайшего ранга
+    """
+    values = sorted(values)
+    return values[max(0, math.ceil(len(values) * percent / 100) - 1)]
+
+
+def check_status(response, expected_status):
+    if response.status_code != expected_status:
+        raise BenchmarkError(
+            f"{response.request['PATH_INFO']}: ожидался ответ {expected_status}, "
+            f"получен {response.status_code}"
+        )
+    return response
+
+
+@contextmanager
+def eager_celery():
+    """
+    Задачи Celery выполняются сразу в текущем процессе
+    """
+    conf = current_app.conf
+    previous = conf.task_always_eager, conf.task_eager_propagates
+    conf.task_always_eager = conf.task_eager_propagates = True
+    try:
+        yield
+    finally:
+        conf.task_always_eager, conf.task_eager_propagates = previous
+
+
+class Scenarios:
+    """
+    Сценарии замеров. Каждый сценарий получает номер запуска,
+    чтобы создавать уникальные записи
+    """
+
+    NAMES = (
+        "main_page",
+        "boxes",
+        "get_boxes",
+        "get_boxes_dates",
+        "quote",
+        "my_rent",
+        "login",
+        "register",
+        "book_box",
+        "sweep_rents_task",
+        "send_outbox_emails_task",
+    )
+
+    def __init__(self):
+        self.storage = Storage.objects.order_by("id").first()
+        self.box = Box.objects.filter(storage=self.storage).order_by("id").first()
+        if self.box is None:
+            raise BenchmarkError(
+                "В базе нет складов с боксами, заполните ее "
+                "командой generate_synthetic_data"
+            )
+
+        self.user = User.objects.create_user(
+            username="benchmark",
+            email=BENCHMARK_EMAIL,
+            password=BENCHMARK_PASSWORD,
+        )
+        # Личный кабинет замеряется для пользователя с наибольшим числом аренд
+        heaviest = (
+            Rent.objects.filter(user__isnull=False)
+            .values("user_id")
+            .annotate(count=Count("id"))
+            .order_by("-count")
+            .first()
+        )
+        self.dashboard_user_id = heaviest["user_id"] if heaviest else self.user.pk
+        self.client = Client()
+        self.logged_client = Client()
+        self.logged_client.force_login(User.objects.get(pk=self.dashboard_user_id))
+        # Аренды создаются на один бокс на непересекающиеся даты далеко в будущем
+        self.first_rent_date = date.today() + timedelta(days=3650)
+
+    def main_page(self, run):
+        check_status(self.client.get(reverse("main_page")), 200)
+
+    def boxes(self, run):
+        check_status(self.client.get(reverse("boxes")), 200)
+
+    def get_boxes(self, run):
+        check_status(self.client.get(reverse("get_boxes", args=[self.storage.pk])), 200)
+
+    def get_boxes_dates(self, run):
+        start_date = date.today() + timedelta(days=7)
+        check_status(
+            self.client.get(
+                reverse("get_boxes", args=[self.storage.pk]),
+                {
+                    "start_date": start_date.isoformat(),
+                    "end_date": (start_date + timedelta(days=30)).isoformat(),
+                },
+            ),
+            200,
+        )
+
+    def quote(self, run):
+        start_date = date.today() + timedelta(days=7)
+        check_status(
+            self.client.get(
+                reverse("get_quote", args=[self.storage.pk]),
+                {
+                    "start_date": start_date.isoformat(),
+                    "end_date": (start_date + timedelta(days=30)).isoformat(),
+                },
+            ),
+            200,
+        )
+
+    def my_rent(self, run):
+        check_status(
+            self.logged_client.get(reverse("my_rent", args=[self.dashboard_user_id])),
+            200,
+        )
+
+    def login(self, run):
+        check_status(
+            Client().post(
+                reverse("login"),
+                {"username": BENCHMARK_EMAIL, "password": BENCHMARK_PASSWORD},
+            ),
+            302,
+        )
+
+    def register(self, run):
+        check_status(
+            Client().post(
+                reverse("register"),
+                {
+                    "email": f"benchmark-{run}@example.com",
+                    "password1": BENCHMARK_PASSWORD,
+                    "password2": BENCHMARK_PASSWORD,
+                },
+            ),
+            302,
+        )
+
+    def book_box(self, run):
+        start_date = self.first_rent_date + timedelta(days=10 * run)
+        check_status(
+            self.client.post(
+                reverse("boxes"),
+                {
+                    "email": BENCHMARK_EMAIL,
+                    "phone": "+79090000000",
+                    "start_date": start_date.isoformat(),
+                    "end_date": (start_date + timedelta(days=5)).isoformat(),
+                    "box": self.box.pk,
+                },
+            ),
+            302,
+        )
+
+    def sweep_rents_task(self, run):
+        sweep_rents_task.delay()
+
+    def send_outbox_emails_task(self, run):
+        send_outbox_emails_task.delay()
+
+
+def isolated_cache(name):
+    """
+    Отдельный кэш в памяти для сценария name
+    """
+    return override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": f"benchmark:{name}",
+                "OPTIONS": {"MAX_ENTRIES": BENCHMARK_CACHE_MAX_ENTRIES},
+            }
+        }
+    )
+
+
+def run_action(action, run):
+    """
+    Выполняет action и функции on_commit, которые он зарегистрировал.
+    Внутри общей транзакции они иначе не выполнились бы, и сценарии
+    не замеряли бы инвалидацию кэша и постановку задач после фиксации
+    """
+    with TestCase.captureOnCommitCallbacks(execute=True):
+        action(run)
+
+
+def measure(action, iterations, warmup, first_run=0, cold=False) -> dict:
+    """
+    Выполняет action warmup раз без замера, затем iterations раз с замером.
+    Если cold, кэш очищается перед каждым замером
+    """
+    runs = range(first_run, first_run + warmup + iterations)
+    for run in runs[:warmup]:
+        run_action(action, run)
+
+    durations = []
+    queries = []
+    for run in runs[warmup:]:
+        if cold:
+            cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            run_action(action, run)
+            durations.append((time.perf_counter() - started) * 1000)
+        queries.append(len(captured))
+
+    return {
+        "p50_ms": round(percentile(durations, 50), 2),
+        "p95_ms": round(percentile(durations, 95), 2),
+        "queries": max(queries),
+    }
+
+
+def run_benchmarks(iterations=20, warmup=3, names=None) -> dict:
+    """
+    Выполняет сценарии names (по умолчанию все) и возвращает результаты
+    замеров: {сценарий: {"warm": замер, "cold": замер}}
+    """
+    names = names or Scenarios.NAMES
+    unknown = set(names) - set(Scenarios.NAMES)
+    if unknown:
+        raise BenchmarkError(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    results = {}
+    with override_settings(
+        EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+        ALLOWED_HOSTS=["testserver"],
+    ), eager_celery(), transaction.atomic():
+        scenarios = Scenarios()
+        for name in names:
+            action = getattr(scenarios, name)
+            with isolated_cache(name):
+                cache.clear()
+                warm = measure(action, iterations, warmup)
+                # Номера запусков продолжаются: сценарии создают уникальные записи
+                cold = measure(
+                    action, iterations, 0, first_run=warmup + iterations, cold=True
+                )
+            results[name] = {"warm": warm, "cold": cold}
+        transaction.set_rollback(True)
+    return results
+
+
+def load_budgets(path=BUDGETS_PATH) -> dict:
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def check_budgets(results, budgets) -> list:
+    """
+    Возвращает описания превышений бюджетов
+    """
+    violations = []
+    for name, modes in results.items():
+        for mode, result in modes.items():
+            for key in BUDGET_KEYS:
+                budget = budgets.get(name, {}).get(mode, {}).get(key)
+                if budget is not None and result[key] > budget:
+                    violations.append(
+                        f"{name} ({mode}): {key} = {result[key]} > {budget}"
+                    )
+    return violations
+
+
+def run_python(code, *options) -> subprocess.CompletedProcess:
+    """
+    Выполняет code в новом процессе интерпретатора с настройками проекта
+    """
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": "sigvard.settings"}
+    return subprocess.run(
+        [sys.executable, *options, "-c", code],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def measure_startup(runs=5) -> dict:
+    """
+    p50 и минимальное время каждого этапа запуска в миллисекундах
+    """
+    results = {}
+    for stage, code in STARTUP_STAGES.items():
+        durations = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            run_python(code)
+            durations.append((time.perf_counter() - started) * 1000)
+        results[stage] = {
+            "p50_ms": round(percentile(durations, 50), 1),
+            "min_ms": round(min(durations), 1),
+        }
+    return results
+
+
+def get_heaviest_imports(top=10) -> list:
+    """
+    Пакеты, импорт которых дольше всего при загрузке WSGI-приложения:
+    [(пакет, мс)]. Время модуля без вложенных импортов по данным
+    python -X importtime суммируется по пакету верхнего уровня
+    """
+    stderr = run_python(STARTUP_STAGES["wsgi"], "-X", "importtime").stderr
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_time, _, name = line.removeprefix("import time:").split("|")
+        if not self_time.strip().isdigit():
+            continue
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_time)
+    heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    return [(package, round(us / 1000, 1)) for package, us in heaviest[:top]]
+
+
+def get_eager_modules() -> list:
+    """
+    Модули из STARTUP_LAZY_MODULES, загруженные вместе с WSGI-приложением
+    """
+    code = (
+        f"{STARTUP_STAGES['wsgi']}; import sys; "
+        f"print(' '.join(m for m in {STARTUP_LAZY_MODULES!r} if m in sys.modules))"
+    )
+    return run_python(code).stdout.split()
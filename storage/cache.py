@@ -0,0 +1,278 @@
+"""
+Кэш каталога складов и боксов.
+
+Каждая запись хранится вместе с версией каталога, для которой она была
+построена. Версии хранятся отдельно: общая для всего каталога и своя для
+каждого склада. При изменении бокса, аренды или склада версия увеличивается
+(см. storage.signals), и запись считается устаревшей.
+
+Так же устроен кэш личного кабинета: его записи привязаны к версии аренд
+пользователя, которая увеличивается при изменении любой его аренды.
+
+Устаревшая запись не удаляется: пересчитывает её только один запрос,
+получивший блокировку, а остальные в это время получают прежнее значение.
+Так всплеск запросов после инвалидации не приводит к лавине запросов к БД.
+
+Если настроены реплики БД, запись, версия которой изменилась недавно,
+пересчитывается по основной БД: отстающая реплика могла еще не получить
+изменение, и запись закэшировала бы старые данные под новой версией.
+"""
+
+import time
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .routers import use_primary
+
+CATALOG_VERSION_KEY = "catalog:version"
+STORAGE_VERSION_KEY = "catalog:version:storage:{storage_id}"
+USER_VERSION_KEY = "rents:version:user:{user_id}"
+ENTRY_KEY = "catalog:entry:{name}"
+LOCK_KEY = "catalog:lock:{name}"
+# Метка недавнего изменения версии, хранится DATABASE_REPLICA_MAX_LAG секунд
+RECENT_BUMP_KEY = "{version_key}:recent"
+
+# Сколько секунд запись считается свежей, даже если версия не менялась
+FRESH_TIMEOUT = 5 * 60
+# Сколько секунд хранится запись, которую можно отдать как устаревшую
+STALE_TIMEOUT = 24 * 60 * 60
+# Максимальное время пересчета записи одним запросом
+LOCK_TIMEOUT = 30
+
+
+def get_version_key(storage_id=None) -> str:
+    """
+    Ключ версии склада или, если склад не указан, всего каталога
+    """
+    if storage_id is None:
+        return CATALOG_VERSION_KEY
+    return STORAGE_VERSION_KEY.format(storage_id=storage_id)
+
+
+def get_user_version_key(user_id) -> str:
+    """
+    Ключ версии аренд пользователя
+    """
+    return USER_VERSION_KEY.format(user_id=user_id)
+
+
+def get_initial_version() -> int:
+    """
+    Начальная версия для отсутствующего ключа.
+
+    Версии начинаются с текущего времени, а не с нуля, чтобы после очистки
+    кэша они не повторяли прежние значения (версии входят в ETag ответов).
+    """
+    return time.time_ns() // 1000
+
+
+def get_version(storage_id=None, version_key=None) -> int:
+    """
+    Текущая версия склада или всего каталога.
+    Вместо склада можно передать ключ версии version_key
+    """
+    key = version_key or get_version_key(storage_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, get_initial_version(), timeout=None)
+        version = cache.get(key, 0)
+    return version
+
+
+async def aget_version(storage_id=None, version_key=None) -> int:
+    """
+    Асинхронная версия get_version
+    """
+    key = version_key or get_version_key(storage_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, get_initial_version(), timeout=None)
+        version = await cache.aget(key, 0)
+    return version
+
+
+def get_storage_version_keys(storage_ids) -> dict:
+    """
+    Ключи версий складов: {ключ: id склада}
+    """
+    return {get_version_key(storage_id): storage_id for storage_id in storage_ids}
+
+
+def get_versions(storage_ids) -> dict:
+    """
+    Текущие версии нескольких складов одним запросом к кэшу
+    """
+    keys = get_storage_version_keys(storage_ids)
+    versions = {
+        keys[key]: version for key, version in cache.get_many(list(keys)).items()
+    }
+    for storage_id in keys.values():
+        if storage_id not in versions:
+            versions[storage_id] = get_version(storage_id)
+    return versions
+
+
+async def aget_versions(storage_ids) -> dict:
+    """
+    Асинхронная версия get_versions
+    """
+    keys = get_storage_version_keys(storage_ids)
+    values = await cache.aget_many(list(keys))
+    versions = {keys[key]: version for key, version in values.items()}
+    for storage_id in keys.values():
+        if storage_id not in versions:
+            versions[storage_id] = await aget_version(storage_id)
+    return versions
+
+
+def bump_version(storage_id=None, version_key=None):
+    """
+    Увеличивает версию склада или всего каталога.
+    Вместо склада можно передать ключ версии version_key
+    """
+    key = version_key or get_version_key(storage_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Ключа еще нет. Если его успели создать параллельно, увеличиваем еще раз
+        if not cache.add(key, get_initial_version(), timeout=None):
+            cache.incr(key)
+    if settings.DATABASE_REPLICAS:
+        cache.set(
+            RECENT_BUMP_KEY.format(version_key=key),
+            1,
+            timeout=settings.DATABASE_REPLICA_MAX_LAG,
+        )
+
+
+def bump_storage_version(storage_id):
+    """
+    Инвалидирует записи склада и общие записи каталога
+    """
+    bump_version(storage_id)
+    bump_version()
+
+
+def bump_storage_version_on_commit(storage_id):
+    """
+    Инвалидирует кэш склада после фиксации транзакции,
+    чтобы пересчет не успел закэшировать еще не сохраненные данные
+    """
+    transaction.on_commit(lambda: bump_storage_version(storage_id))
+
+
+def bump_user_version_on_commit(user_id):
+    """
+    Инвалидирует кэш личного кабинета пользователя после фиксации транзакции
+    """
+    version_key = get_user_version_key(user_id)
+    transaction.on_commit(lambda: bump_version(version_key=version_key))
+
+
+def get_entry_keys(name: str, storage_id=None, version_key=None) -> tuple:
+    """
+    Ключи записи name, ее версии и метки недавнего изменения версии
+    """
+    version_key = version_key or get_version_key(storage_id)
+    return (
+        ENTRY_KEY.format(name=name),
+        version_key,
+        RECENT_BUMP_KEY.format(version_key=version_key),
+    )
+
+
+def is_fresh(entry, version) -> bool:
+    """
+    Запись построена для текущей версии и ее срок свежести не истек
+    """
+    entry_version, fresh_until, _ = entry
+    return entry_version == version and fresh_until > time.time()
+
+
+def make_entry(version, value, timeout) -> tuple:
+    return version, time.time() + timeout, value
+
+
+def get_build_context(values: dict, recent_bump_key: str):
+    """
+    Контекст пересчета записи: основная БД, если версия изменилась недавно
+    """
+    return use_primary() if recent_bump_key in values else nullcontext()
+
+
+def get_or_build(
+    name: str, builder, storage_id=None, timeout=FRESH_TIMEOUT, version_key=None
+):
+    """
+    Возвращает значение записи каталога name, при необходимости пересчитывая
+    его функцией builder.
+
+    Запись привязана к версии склада storage_id или, если склад не указан,
+    к версии всего каталога. Вместо склада можно передать ключ версии version_key.
+    """
+    entry_key, version_key, recent_bump_key = get_entry_keys(
+        name, storage_id, version_key
+    )
+    values = cache.get_many([entry_key, version_key, recent_bump_key])
+    entry = values.get(entry_key)
+    version = values.get(version_key)
+    if version is None:
+        version = get_version(version_key=version_key)
+
+    lock_key = None
+    if entry is not None:
+        if is_fresh(entry, version):
+            return entry[2]
+
+        lock_key = LOCK_KEY.format(name=name)
+        if not cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+            # Запись уже пересчитывает другой запрос
+            return entry[2]
+
+    try:
+        with get_build_context(values, recent_bump_key):
+            value = builder()
+        cache.set(entry_key, make_entry(version, value, timeout), STALE_TIMEOUT)
+    finally:
+        if lock_key:
+            cache.delete(lock_key)
+
+    return value
+
+
+async def aget_or_build(
+    name: str, builder, storage_id=None, timeout=FRESH_TIMEOUT, version_key=None
+):
+    """
+    Асинхронная версия get_or_build: builder - асинхронная функция
+    """
+    entry_key, version_key, recent_bump_key = get_entry_keys(
+        name, storage_id, version_key
+    )
+    values = await cache.aget_many([entry_key, version_key, recent_bump_key])
+    entry = values.get(entry_key)
+    version = values.get(version_key)
+    if version is None:
+        version = await aget_version(version_key=version_key)
+
+    lock_key = None
+    if entry is not None:
+        if is_fresh(entry, version):
+            return entry[2]
+
+        lock_key = LOCK_KEY.format(name=name)
+        if not await cache.aadd(lock_key, 1, timeout=LOCK_TIMEOUT):
+            return entry[2]
+
+    try:
+        with get_build_context(values, recent_bump_key):
+            value = await builder()
+        await cache.aset(entry_key, make_entry(version, value, timeout), STALE_TIMEOUT)
+    finally:
+        if lock_key:
+            await cache.adelete(lock_key)
+
+    return value
@@ -1,13 +1,16 @@
 from django.http import HttpRequest
+from django.utils.functional import SimpleLazyObject
 
 from storage.forms import UserRegisterForm, UserLoginForm
 
 
 def auth_forms(request: HttpRequest) -> dict:
     """
-    Добавляет формы регистрации и авторизации в контекст всех шаблонов
+    Добавляет формы регистрации и авторизации в контекст всех шаблонов.
+
+    Формы создаются только при обращении к ним из шаблона
     """
     return {
-        "register_form": UserRegisterForm(),
-        "login_form": UserLoginForm(),
+        "register_form": SimpleLazyObject(UserRegisterForm),
+        "login_form": SimpleLazyObject(UserLoginForm),
     }
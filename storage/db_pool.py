@@ -0,0 +1,155 @@
+"""
+Статистика пулов соединений с PostgreSQL.
+
+Каждый веб-процесс и воркер Celery держит свой пул соединений psycopg 3
+(настройки DATABASE_POOL_* в settings). После запросов и задач (обработчик
+сигнала Celery в storage.task_metrics) процесс не чаще раза
+в PUBLISH_INTERVAL секунд записывает статистику своих пулов в кэш, откуда
+ее собирают /metrics/ и команда celery_stats.
+"""
+
+import os
+import socket
+import time
+
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.db import connections
+
+POOL_STATS_KEY = "db:pool:{process}"
+# Процессы, которые публиковали статистику, и время последней публикации.
+# При одновременной записи процесс может пропасть из списка до своей
+# следующей публикации
+PROCESSES_KEY = "db:pool:processes"
+PUBLISH_INTERVAL = 10
+# Статистика процесса, который перестал ее обновлять, удаляется
+PROCESS_TIMEOUT = 60
+
+last_published = {"pid": None, "time": 0.0}
+
+
+def get_process_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def get_pool(connection):
+    """
+    Пул соединения, если он уже создан. Свойство connection.pool
+    создает пул при первом обращении
+    """
+    # Пул есть только у PostgreSQL с настройкой OPTIONS["pool"]
+    if connection.alias not in getattr(connection, "_connection_pools", {}):
+        return None
+    return connection.pool
+
+
+def get_pool_stats() -> dict:
+    """
+    Статистика пулов текущего процесса: {псевдоним БД: статистика}
+    """
+    stats = {}
+    for connection in connections.all(initialized_only=True):
+        pool = get_pool(connection)
+        if pool is None:
+            continue
+        pool_stats = pool.get_stats()
+        stats[connection.alias] = {
+            "size": pool_stats.get("pool_size", 0),
+            "max_size": pool_stats.get("pool_max", 0),
+            "checked_out": pool_stats.get("pool_size", 0)
+            - pool_stats.get("pool_available", 0),
+            "waiting": pool_stats.get("requests_waiting", 0),
+            "created": pool_stats.get("connections_num", 0),
+            "timeouts": pool_stats.get("requests_errors", 0),
+        }
+    return stats
+
+
+def close_pools():
+    """
+    Закрывает соединения и пулы процесса.
+
+    Вызывается в главном процессе gunicorn перед запуском воркеров:
+    сокеты, унаследованные при fork, использовали бы несколько процессов
+    """
+    for connection in connections.all(initialized_only=True):
+        connection.close()
+        if get_pool(connection) is not None:
+            connection.close_pool()
+
+
+def publish_pool_stats(force=False):
+    """
+    Записывает статистику пулов процесса в кэш, если с прошлой записи
+    прошло PUBLISH_INTERVAL секунд
+    """
+    pid = os.getpid()
+    current_time = time.time()
+    if (
+        not force
+        and last_published["pid"] == pid
+        and current_time - last_published["time"] < PUBLISH_INTERVAL
+    ):
+        return
+    last_published.update(pid=pid, time=current_time)
+
+    stats = get_pool_stats()
+    if not stats:
+        return
+    process = get_process_name()
+    cache.set(POOL_STATS_KEY.format(process=process), stats, PROCESS_TIMEOUT)
+    processes = {
+        name: seen_at
+        for name, seen_at in cache.get(PROCESSES_KEY, {}).items()
+        if current_time - seen_at < PROCESS_TIMEOUT
+    }
+    processes[process] = current_time
+    cache.set(PROCESSES_KEY, processes, PROCESS_TIMEOUT)
+
+
+def get_published_pool_stats() -> dict:
+    """
+    Статистика пулов всех процессов: {процесс: {псевдоним БД: статистика}}
+    """
+    processes = cache.get(PROCESSES_KEY, {})
+    keys = {POOL_STATS_KEY.format(process=process): process for process in processes}
+    return {
+        keys[key]: stats for key, stats in sorted(cache.get_many(list(keys)).items())
+    }
+
+
+def render_prometheus(pool_stats) -> str:
+    """
+    Статистика пулов в текстовом формате Prometheus
+    """
+    lines = []
+    for name, key, metric_type, description in (
+        ("db_pool_connections", "size", "gauge", "Открытые соединения пула"),
+        ("db_pool_max_connections", "max_size", "gauge", "Размер пула"),
+        ("db_pool_checked_out", "checked_out", "gauge", "Выданные соединения"),
+        ("db_pool_waiting", "waiting", "gauge", "Запросы, ждущие соединения"),
+        (
+            "db_pool_connections_created_total",
+            "created",
+            "counter",
+            "Созданные соединения",
+        ),
+        (
+            "db_pool_timeouts_total",
+            "timeouts",
+            "counter",
+            "Запросы, не дождавшиеся соединения",
+        ),
+    ):
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"]
+        for process, aliases in pool_stats.items():
+            for alias, stats in aliases.items():
+                lines.append(
+                    f'{name}{{process="{process}",database="{alias}"}} {stats[key]}'
+                )
+    return "\n".join(lines) + "\n"
+
+
+@request_finished.connect
+def publish_after_request(sender=None, **kwargs):
+    publish_pool_stats()
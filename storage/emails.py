@@ -1,16 +1,154 @@
+import logging
+from datetime import timedelta
+
+from django.apps import apps
 from django.conf import settings
-from django.core.mail import EmailMessage
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.utils.timezone import now
+
+from . import task_metrics
+
+logger = logging.getLogger(__name__)
+
+# Сколько писем из очереди отправляется за одно SMTP-соединение
+OUTBOX_BATCH_SIZE = 100
+# После стольких неудачных попыток письмо помечается как неотправленное
+OUTBOX_MAX_ATTEMPTS = 5
+# Задержка перед повторной попыткой, удваивается с каждой попыткой
+OUTBOX_RETRY_DELAY = timedelta(minutes=1)
+# Через столько письмо, взятое на отправку, снова попадает в очередь,
+# если воркер не записал результат
+OUTBOX_SENDING_TIMEOUT = timedelta(minutes=10)
+
+
+def register_outbox_failure(outbox_email, error):
+    """
+    Записывает ошибку отправки и планирует повторную попытку
+    """
+    outbox_email.last_error = repr(error)
+    if outbox_email.attempts >= OUTBOX_MAX_ATTEMPTS:
+        outbox_email.status = "failed"
+    else:
+        outbox_email.status = "pending"
+        outbox_email.next_attempt_at = now() + OUTBOX_RETRY_DELAY * 2 ** (
+            outbox_email.attempts - 1
+        )
+
+
+def claim_outbox_emails(batch_size) -> list:
+    """
+    Берет пачку писем на отправку в короткой транзакции: письма получают
+    статус "sending" и засчитанную попытку, next_attempt_at становится
+    сроком, после которого письмо снова попадет в очередь, если воркер
+    упадет, не записав результат.
+
+    Блокировка строк (SKIP LOCKED) снимается при фиксации, поэтому
+    SMTP-сессия не держит транзакцию и соединение с БД
+    """
+    OutboxEmail = apps.get_model("storage", "OutboxEmail")
 
+    with transaction.atomic():
+        outbox_emails = list(
+            OutboxEmail.objects.due()
+            .select_for_update(skip_locked=True)
+            .order_by("next_attempt_at")[:batch_size]
+        )
+        claimed_until = now() + OUTBOX_SENDING_TIMEOUT
+        for outbox_email in outbox_emails:
+            if outbox_email.attempts >= OUTBOX_MAX_ATTEMPTS:
+                # Последняя попытка не завершилась: повторять больше нельзя
+                outbox_email.status = "failed"
+                outbox_email.last_error = "Отправка не завершена"
+            else:
+                outbox_email.status = "sending"
+                outbox_email.attempts += 1
+                outbox_email.next_attempt_at = claimed_until
+        OutboxEmail.objects.bulk_update(
+            outbox_emails, ["status", "attempts", "last_error", "next_attempt_at"]
+        )
 
-def send_email_message(subject, message, user_email):
+    return outbox_emails
+
+
+def release_outbox_claim(outbox_emails, error):
     """
-    Функция отправки письма
+    Возвращает письма в очередь, не засчитывая попытку: письма не были
+    отправлены из-за недоступного SMTP-сервера, а не из-за ошибки в самом
+    письме, и иначе за время сбоя сервера исчерпали бы все попытки
     """
+    OutboxEmail = apps.get_model("storage", "OutboxEmail")
+    OutboxEmail.objects.filter(
+        pk__in=[outbox_email.pk for outbox_email in outbox_emails], status="sending"
+    ).update(
+        status="pending",
+        attempts=F("attempts") - 1,
+        last_error=repr(error),
+        next_attempt_at=now() + OUTBOX_RETRY_DELAY,
+    )
+
 
-    email_message = EmailMessage(
-        subject=subject,
-        body=message,
-        from_email=settings.SERVER_EMAIL,
-        to=[user_email],
+def save_outbox_result(outbox_email):
+    outbox_email.save(
+        update_fields=["status", "last_error", "next_attempt_at", "sent_at"]
     )
-    email_message.send(fail_silently=False)
+
+
+def send_outbox_batch(batch_size=OUTBOX_BATCH_SIZE) -> int:
+    """
+    Отправляет пачку писем из очереди через одно SMTP-соединение.
+
+    Письма берутся на отправку в отдельной транзакции (claim_outbox_emails),
+    поэтому несколько воркеров разбирают очередь, не отправляя одно письмо
+    дважды. Отправка идет вне транзакции, результат каждого письма
+    записывается сразу после его отправки. Попытка засчитывается только
+    при ошибке отправки письма: если SMTP-сервер недоступен, письма
+    возвращаются в очередь без изменения числа попыток.
+    Возвращает число обработанных писем
+    """
+    outbox_emails = claim_outbox_emails(batch_size)
+    outbox_emails_to_send = [
+        outbox_email
+        for outbox_email in outbox_emails
+        if outbox_email.status == "sending"
+    ]
+    if not outbox_emails_to_send:
+        return len(outbox_emails)
+
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as error:
+        logger.warning("Не удалось подключиться к SMTP-серверу: %r", error)
+        release_outbox_claim(outbox_emails_to_send, error)
+        return len(outbox_emails)
+
+    sent = []
+    try:
+        for outbox_email in outbox_emails_to_send:
+            email_message = EmailMessage(
+                subject=outbox_email.subject,
+                body=outbox_email.body,
+                from_email=settings.SERVER_EMAIL,
+                to=[outbox_email.to],
+                connection=connection,
+            )
+            try:
+                email_message.send(fail_silently=False)
+            except Exception as error:
+                logger.warning(
+                    "Не удалось отправить письмо %s: %r", outbox_email.pk, error
+                )
+                register_outbox_failure(outbox_email, error)
+            else:
+                outbox_email.status = "sent"
+                outbox_email.sent_at = now()
+                sent.append(outbox_email)
+            save_outbox_result(outbox_email)
+    finally:
+        connection.close()
+
+    task_metrics.observe_email_delays(sent)
+
+    return len(outbox_emails)
@@ -1,4 +1,9 @@
-from datetime import date
+import base64
+import hashlib
+import json
+import math
+from datetime import date, datetime, time
+from decimal import Decimal
 
 from django import forms
 from django.contrib.auth import authenticate
@@ -6,11 +11,32 @@ from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
 
 from .models import Rent, Box
 
 
+def to_aware_datetime(day: date) -> datetime:
+    """
+    Начало дня в текущем часовом поясе
+    """
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def normalize_decimals(value):
+    """
+    Значение с Decimal без незначащих нулей: 10, 10.0 и 10.00 совпадают
+    """
+    if isinstance(value, Decimal):
+        return value.normalize()
+    if isinstance(value, (list, tuple)):
+        return [normalize_decimals(item) for item in value]
+    return value
+
+
 class RentForm(forms.ModelForm):
     """
     Форма аренды бокса.
@@ -55,14 +81,16 @@ class RentForm(forms.ModelForm):
             }
         ),
     )
+    # Бокс выбирается в списке боксов склада на странице, в форму попадает
+    # только его id: выпадающий список рендерил бы все боксы базы
     box = forms.ModelChoiceField(
         label="",
-        queryset=Box.objects.filter(is_occupied=False),
-        widget=forms.Select(
-            attrs={
-                "class": "form-control border-8 mb-4 py-3 px-5 border-0 fs_24 SelfStorage__bg_lightgrey",
-            }
-        ),
+        queryset=Box.objects.select_related("storage"),
+        widget=forms.HiddenInput,
+        error_messages={
+            "required": "Выберите бокс в списке боксов.",
+            "invalid_choice": "Выбранный бокс не найден.",
+        },
     )
 
     class Meta:
@@ -95,9 +123,309 @@ class RentForm(forms.ModelForm):
                 raise forms.ValidationError(
                     "Дата окончания аренды должна быть позже даты начала."
                 )
+            # Занятость бокса на эти даты проверяет Rent.clean()
+            cleaned_data["start_date"] = to_aware_datetime(start_date)
+            cleaned_data["end_date"] = to_aware_datetime(end_date)
+
+        return cleaned_data
+
+
+class BoxFilterForm(forms.Form):
+    """
+    Фильтры, сортировка и постраничный вывод списка свободных боксов.
+
+    Страницы выбираются по ключу (keyset): курсор хранит значение поля
+    сортировки и id последнего бокса предыдущей страницы.
+    """
+
+    FIELDS = ("id", "number", "area", "price", "level", "length", "width", "height")
+    ORDERING_CHOICES = [
+        (ordering, ordering)
+        for field in ("price", "area", "level", "height", "number")
+        for ordering in (field, f"-{field}")
+    ]
+    DEFAULT_ORDERING = "price"
+    DEFAULT_LIMIT = 50
+    MAX_LIMIT = 200
+
+    start_date = forms.DateField(required=False)
+    end_date = forms.DateField(required=False)
+    area_min = forms.DecimalField(required=False)
+    area_max = forms.DecimalField(required=False)
+    price_min = forms.DecimalField(required=False)
+    price_max = forms.DecimalField(required=False)
+    level_min = forms.IntegerField(required=False)
+    level_max = forms.IntegerField(required=False)
+    height_min = forms.FloatField(required=False)
+    height_max = forms.FloatField(required=False)
+    ordering = forms.ChoiceField(choices=ORDERING_CHOICES, required=False)
+    cursor = forms.CharField(required=False)
+    limit = forms.IntegerField(required=False, min_value=1, max_value=MAX_LIMIT)
+
+    def clean_cursor(self):
+        cursor = self.cleaned_data.get("cursor")
+        if not cursor:
+            return None
+        # Значение курсора приводится к типу поля сортировки: иначе строка
+        # или список из подделанного курсора попадут в фильтр и запрос
+        # завершится ошибкой базы данных вместо ответа 400
+        ordering = self.cleaned_data.get("ordering") or self.DEFAULT_ORDERING
+        model_field = Box._meta.get_field(ordering.lstrip("-"))
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(cursor))
+            value = model_field.to_python(value)
+            pk = int(pk)
+            if value is None:
+                raise ValueError(value)
+            if isinstance(value, (Decimal, float)) and not math.isfinite(value):
+                raise ValueError(value)
+        except (ValueError, TypeError, ValidationError):
+            raise forms.ValidationError("Некорректный курсор.")
+        return value, pk
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_date = cleaned_data.get("start_date")
+        end_date = cleaned_data.get("end_date")
+        if bool(start_date) != bool(end_date):
+            raise forms.ValidationError("Укажите обе даты аренды.")
+        if start_date and end_date <= start_date:
+            raise forms.ValidationError(
+                "Дата окончания аренды должна быть позже даты начала."
+            )
+        return cleaned_data
+
+    def get_cache_key(self) -> str:
+        """
+        Хэш проверенных параметров с подставленными значениями по умолчанию.
+
+        Запросы, которые отличаются только записью значений (10 и 10.0),
+        порядком параметров или параметрами, которых нет в форме, получают
+        одну запись кэша
+        """
+        values = {
+            **self.cleaned_data,
+            "ordering": self.cleaned_data.get("ordering") or self.DEFAULT_ORDERING,
+            "limit": self.cleaned_data.get("limit") or self.DEFAULT_LIMIT,
+        }
+        key = json.dumps(
+            {name: normalize_decimals(value) for name, value in values.items()},
+            sort_keys=True,
+            cls=DjangoJSONEncoder,
+        )
+        return hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
+
+    def filter(self, queryset):
+        """
+        Применяет фильтры по датам аренды и диапазонам площади, цены,
+        этажа и высоты.
+
+        Если даты не указаны, возвращаются боксы, свободные сейчас
+        """
+        start_date = self.cleaned_data.get("start_date")
+        end_date = self.cleaned_data.get("end_date")
+        if start_date and end_date:
+            queryset = queryset.available_between(
+                to_aware_datetime(start_date), to_aware_datetime(end_date)
+            )
+        else:
+            queryset = queryset.filter(is_occupied=False)
+
+        for field in ("area", "price", "level", "height"):
+            minimum = self.cleaned_data.get(f"{field}_min")
+            maximum = self.cleaned_data.get(f"{field}_max")
+            if minimum is not None:
+                queryset = queryset.filter(**{f"{field}__gte": minimum})
+            if maximum is not None:
+                queryset = queryset.filter(**{f"{field}__lte": maximum})
+        return queryset
+
+    def get_page_queryset(self, queryset):
+        """
+        Боксы страницы в виде словарей и еще один бокс после нее,
+        по которому видно, есть ли следующая страница
+        """
+        ordering = self.cleaned_data.get("ordering") or self.DEFAULT_ORDERING
+        limit = self.cleaned_data.get("limit") or self.DEFAULT_LIMIT
+        field = ordering.lstrip("-")
+        descending = ordering.startswith("-")
+
+        queryset = self.filter(queryset)
+        if self.cleaned_data.get("cursor"):
+            value, pk = self.cleaned_data["cursor"]
+            lookup = "lt" if descending else "gt"
+            queryset = queryset.filter(
+                Q(**{f"{field}__{lookup}": value})
+                | Q(**{field: value, f"id__{lookup}": pk})
+            )
+        queryset = queryset.order_by(ordering, "-id" if descending else "id")
+        return queryset.values(*self.FIELDS)[: limit + 1]
+
+    def make_page(self, boxes) -> dict:
+        """
+        Страница из результата get_page_queryset и курсор следующей страницы
+        """
+        ordering = self.cleaned_data.get("ordering") or self.DEFAULT_ORDERING
+        limit = self.cleaned_data.get("limit") or self.DEFAULT_LIMIT
+        field = ordering.lstrip("-")
+
+        next_cursor = None
+        if len(boxes) > limit:
+            boxes = boxes[:limit]
+            last_box = boxes[-1]
+            next_cursor = base64.urlsafe_b64encode(
+                json.dumps(
+                    [last_box[field], last_box["id"]], cls=DjangoJSONEncoder
+                ).encode()
+            ).decode()
+
+        for box in boxes:
+            box["area"] = float(box["area"])
+            box["price"] = float(box["price"])
+
+        return {"boxes": boxes, "next": next_cursor}
 
+    def get_page(self, queryset) -> dict:
+        """
+        Возвращает страницу боксов в виде словарей и курсор следующей страницы
+        """
+        return self.make_page(list(self.get_page_queryset(queryset)))
+
+    async def aget_page(self, queryset) -> dict:
+        """
+        Асинхронная версия get_page
+        """
+        boxes = [box async for box in self.get_page_queryset(queryset)]
+        return self.make_page(boxes)
+
+
+class QuoteForm(forms.Form):
+    """
+    Стоимость аренды всех свободных боксов склада на период.
+
+    Стоимость считается так же, как при сохранении аренды
+    (Rent.get_rental_price), по колонке цен боксов без создания
+    объектов Box.
+    """
+
+    FIELDS = ("id", "number", "area", "price")
+
+    start_date = forms.DateField()
+    end_date = forms.DateField()
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_date = cleaned_data.get("start_date")
+        end_date = cleaned_data.get("end_date")
+        if start_date and end_date:
+            if start_date < date.today():
+                raise forms.ValidationError(
+                    "Дата начала аренды не может быть в прошлом."
+                )
+            if end_date <= start_date:
+                raise forms.ValidationError(
+                    "Дата окончания аренды должна быть позже даты начала."
+                )
         return cleaned_data
 
+    def get_quote_queryset(self, queryset):
+        """
+        Боксы, свободные на весь период, в виде словарей.
+        Стоимость пропорциональна цене, поэтому сортировка по цене
+        """
+        return (
+            queryset.available_between(
+                to_aware_datetime(self.cleaned_data["start_date"]),
+                to_aware_datetime(self.cleaned_data["end_date"]),
+            )
+            .order_by("price", "id")
+            .values(*self.FIELDS)
+        )
+
+    def make_quote(self, boxes) -> dict:
+        """
+        Стоимость аренды боксов из результата get_quote_queryset
+        """
+        start_date = self.cleaned_data["start_date"]
+        end_date = self.cleaned_data["end_date"]
+        rental_days = Rent.get_rental_days(start_date, end_date)
+        # Боксы с одной ценой стоят одинаково, стоимость считается
+        # один раз для каждой цены
+        total_prices = {}
+        for box in boxes:
+            price = box["price"]
+            if price not in total_prices:
+                total_prices[price] = Rent.get_rental_price(price, rental_days)
+            box["total_price"] = float(total_prices[price])
+            box["area"] = float(box["area"])
+            box["price"] = float(price)
+
+        return {
+            "start_date": start_date.isoformat(),
+            "end_date": end_date.isoformat(),
+            "days": rental_days,
+            "boxes": boxes,
+        }
+
+    async def aget_quote(self, queryset) -> dict:
+        """
+        Стоимость аренды свободных боксов queryset на период
+        """
+        boxes = [box async for box in self.get_quote_queryset(queryset)]
+        return self.make_quote(boxes)
+
+
+class RentHistoryForm(forms.Form):
+    """
+    Страница истории аренд личного кабинета.
+
+    Аренды идут от последних к первым, страницы выбираются по ключу:
+    курсор хранит end_date и id последней аренды предыдущей страницы.
+    """
+
+    LIMIT = 20
+
+    cursor = forms.CharField(required=False)
+
+    def clean_cursor(self):
+        cursor = self.cleaned_data.get("cursor")
+        if not cursor:
+            return None
+        try:
+            end_date, pk = json.loads(base64.urlsafe_b64decode(cursor))
+            end_date = datetime.fromisoformat(end_date)
+            pk = int(pk)
+        except (ValueError, TypeError):
+            raise forms.ValidationError("Некорректный курсор.")
+        # Курсор, выданный сервером, содержит смещение часового пояса;
+        # дата без него считается датой в текущем часовом поясе
+        if timezone.is_naive(end_date):
+            end_date = timezone.make_aware(end_date)
+        return end_date, pk
+
+    def get_page(self, queryset) -> dict:
+        """
+        Возвращает страницу аренд в виде словарей и курсор следующей страницы
+        """
+        if self.cleaned_data.get("cursor"):
+            end_date, pk = self.cleaned_data["cursor"]
+            queryset = queryset.filter(
+                Q(end_date__lt=end_date) | Q(end_date=end_date, id__lt=pk)
+            )
+        rents = list(queryset.order_by("-end_date", "-id")[: self.LIMIT + 1])
+
+        next_cursor = None
+        if len(rents) > self.LIMIT:
+            rents = rents[: self.LIMIT]
+            last_rent = rents[-1]
+            next_cursor = base64.urlsafe_b64encode(
+                json.dumps(
+                    [last_rent["end_date"].isoformat(), last_rent["id"]]
+                ).encode()
+            ).decode()
+
+        return {"rents": rents, "next": next_cursor}
+
 
 class UserRegisterForm(UserCreationForm):
     """
@@ -0,0 +1,84 @@
+"""
+Нагрузочный тест запущенного сервера по HTTP.
+
+Нужен, чтобы сравнить под одновременной нагрузкой WSGI (gunicorn с
+синхронными воркерами) и ASGI (uvicorn) с тем же числом процессов:
+каждый из concurrency потоков держит свое keep-alive соединение
+и отправляет GET-запросы один за другим, пока не будет отправлено
+requests запросов.
+"""
+
+import http.client
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from .benchmarks import percentile
+
+
+class LoadTestError(Exception):
+    """
+    Некорректный адрес или сервер недоступен
+    """
+
+
+def get_connection_class(scheme):
+    if scheme == "http":
+        return http.client.HTTPConnection
+    if scheme == "https":
+        return http.client.HTTPSConnection
+    raise LoadTestError(f"Неподдерживаемая схема адреса: {scheme}")
+
+
+def run_load_test(url, requests=1000, concurrency=50, timeout=30) -> dict:
+    """
+    Отправляет requests GET-запросов на url в concurrency потоков.
+    Возвращает число запросов в секунду, p50 и p95 времени ответа
+    и число ошибок: ответов не 2xx/3xx и неудачных соединений
+    """
+    parts = urlsplit(url)
+    connection_class = get_connection_class(parts.scheme)
+    path = parts.path or "/"
+    if parts.query:
+        path += f"?{parts.query}"
+
+    local = threading.local()
+
+    def send(_):
+        connection = getattr(local, "connection", None)
+        if connection is None:
+            connection = local.connection = connection_class(
+                parts.netloc, timeout=timeout
+            )
+        started = time.perf_counter()
+        try:
+            connection.request("GET", path)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            # Соединение открывается заново при следующем запросе
+            connection.close()
+            local.connection = None
+            return None
+        if response.will_close:
+            connection.close()
+            local.connection = None
+        if response.status >= 400:
+            return None
+        return (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    durations = [duration for duration in results if duration is not None]
+    if not durations:
+        raise LoadTestError(f"{url}: ни один запрос не выполнен успешно")
+    return {
+        "rps": round(len(durations) / elapsed, 1),
+        "p50_ms": round(percentile(durations, 50), 2),
+        "p95_ms": round(percentile(durations, 95), 2),
+        "errors": requests - len(durations),
+    }
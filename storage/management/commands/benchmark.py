@@ -0,0 +1,89 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from storage.benchmarks import (
+    BUDGETS_PATH,
+    BenchmarkError,
+    Scenarios,
+    check_budgets,
+    load_budgets,
+    run_benchmarks,
+)
+
+# Запас при записи бюджетов по результатам замера
+LATENCY_HEADROOM = 2
+# Наименьший бюджет времени: быстрые сценарии не должны падать
+# из-за разброса в несколько миллисекунд на другой машине
+MIN_LATENCY_BUDGET_MS = 50
+
+
+def get_latency_budget(value) -> float:
+    return max(round(value * LATENCY_HEADROOM, 1), MIN_LATENCY_BUDGET_MS)
+
+
+class Command(BaseCommand):
+    help = (
+        "Замерить время ответа (p50, p95) и число SQL-запросов представлений "
+        "и задач и сравнить с бюджетами"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "scenarios", nargs="*", help=f"Сценарии: {', '.join(Scenarios.NAMES)}"
+        )
+        parser.add_argument("--iterations", type=int, default=20)
+        parser.add_argument("--warmup", type=int, default=3)
+        parser.add_argument("--budgets", default=BUDGETS_PATH, help="Файл с бюджетами")
+        parser.add_argument(
+            "--write-budgets",
+            action="store_true",
+            help=(
+                "Записать бюджеты по результатам замера: число запросов как есть, "
+                f"время с запасом x{LATENCY_HEADROOM}, "
+                f"но не меньше {MIN_LATENCY_BUDGET_MS} мс"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        try:
+            results = run_benchmarks(
+                options["iterations"], options["warmup"], options["scenarios"]
+            )
+        except BenchmarkError as error:
+            raise CommandError(error)
+
+        self.stdout.write(
+            f"{'Сценарий':<26}{'Кэш':<6}{'p50, мс':>10}{'p95, мс':>10}{'SQL':>6}"
+        )
+        for name, modes in results.items():
+            for mode, result in modes.items():
+                self.stdout.write(
+                    f"{name:<26}{mode:<6}{result['p50_ms']:>10}"
+                    f"{result['p95_ms']:>10}{result['queries']:>6}"
+                )
+
+        if options["write_budgets"]:
+            budgets = {
+                name: {
+                    mode: {
+                        "p50_ms": get_latency_budget(result["p50_ms"]),
+                        "p95_ms": get_latency_budget(result["p95_ms"]),
+                        "queries": result["queries"],
+                    }
+                    for mode, result in modes.items()
+                }
+                for name, modes in results.items()
+            }
+            with open(options["budgets"], "w", encoding="utf-8") as file:
+                json.dump(budgets, file, indent=2)
+                file.write("\n")
+            self.stdout.write(
+                self.style.SUCCESS(f"Бюджеты записаны в {options['budgets']}")
+            )
+            return
+
+        violations = check_budgets(results, load_budgets(options["budgets"]))
+        if violations:
+            raise CommandError("Превышены бюджеты:\n" + "\n".join(violations))
+        self.stdout.write(self.style.SUCCESS("Все бюджеты соблюдены"))
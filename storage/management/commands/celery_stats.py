@@ -0,0 +1,104 @@
+from django.core.management.base import BaseCommand
+
+from storage import db_pool
+from storage.task_metrics import (
+    EVENT_HISTOGRAMS,
+    get_broker_stats,
+    get_count,
+    get_event_stats,
+    get_outbox_stats,
+    get_task_stats,
+    render_outbox_prometheus,
+    render_prometheus,
+)
+
+# Подписи гистограмм очереди писем и обхода аренд
+EVENT_TITLES = {
+    "outbox_delay": "Задержка отправки писем",
+    "sweep_lateness:reminder": "Опоздание напоминаний об окончании аренды",
+    "sweep_lateness:expire": "Опоздание перевода аренд в 'просрочено'",
+}
+
+
+def get_average(stats, metric) -> str:
+    count = get_count(stats, metric)
+    if not count:
+        return "-"
+    return f"{stats[f'{metric}:sum_ms'] / count / 1000:.2f}"
+
+
+def get_event_average(stats, histogram) -> str:
+    count = sum(stats[f"bucket:{bucket}"] for bucket in EVENT_HISTOGRAMS[histogram])
+    if not count:
+        return "-"
+    return f"{stats['sum_ms'] / count / 1000:.2f}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Показать метрики задач Celery: запуски, среднее время выполнения "
+        "и опоздания, задачи с eta, длину очередей брокера, очередь писем, "
+        "опоздание обхода аренд и пулы соединений с БД"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--prometheus",
+            action="store_true",
+            help="Вывести метрики в текстовом формате Prometheus",
+        )
+
+    def handle(self, *args, **options):
+        task_stats = get_task_stats()
+        broker_stats = get_broker_stats()
+        outbox_stats = get_outbox_stats()
+        event_stats = get_event_stats()
+        pool_stats = db_pool.get_published_pool_stats()
+        if options["prometheus"]:
+            self.stdout.write(
+                render_prometheus(task_stats, broker_stats)
+                + render_outbox_prometheus(outbox_stats, event_stats)
+                + db_pool.render_prometheus(pool_stats),
+                ending="",
+            )
+            return
+
+        self.stdout.write(
+            f"{'Задача':<50}{'успешно':>9}{'ошибки':>8}{'повторы':>9}"
+            f"{'время, с':>10}{'опоздание, с':>14}{'eta':>6}"
+        )
+        for task_name, stats in task_stats.items():
+            self.stdout.write(
+                f"{task_name:<50}{stats['succeeded']:>9}{stats['failed']:>8}"
+                f"{stats['retried']:>9}{get_average(stats, 'duration'):>10}"
+                f"{get_average(stats, 'lateness'):>14}"
+                f"{stats['eta_pending']:>6}"
+            )
+
+        if broker_stats is None:
+            self.stdout.write(self.style.WARNING("Брокер недоступен"))
+        else:
+            for queue, length in broker_stats["queues"].items():
+                self.stdout.write(f"Очередь {queue}: {length}")
+            self.stdout.write(
+                f"Выдано воркерам и не подтверждено: {broker_stats['unacked']}"
+            )
+
+        for status, stats in outbox_stats.items():
+            self.stdout.write(
+                f"Письма со статусом {status}: {stats['count']}, "
+                f"самое старое {stats['oldest_age']:.0f} с"
+            )
+        for histogram, stats in event_stats.items():
+            self.stdout.write(
+                f"{EVENT_TITLES[histogram]}, в среднем, с: "
+                f"{get_event_average(stats, histogram)}"
+            )
+
+        for process, aliases in pool_stats.items():
+            for alias, stats in aliases.items():
+                self.stdout.write(
+                    f"Пул {alias} процесса {process}: выдано {stats['checked_out']} "
+                    f"из {stats['size']} (максимум {stats['max_size']}), "
+                    f"ждут {stats['waiting']}, создано {stats['created']}"
+                )
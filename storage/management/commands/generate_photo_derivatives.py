@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from storage.models import Storage
+from storage.thumbnails import generate_photo_derivatives
+
+
+class Command(BaseCommand):
+    help = "Создать уменьшенные копии фотографий складов"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Пересоздать копии и для складов, у которых они уже есть",
+        )
+
+    def handle(self, *args, **options):
+        storages = Storage.objects.exclude(photo="").order_by("pk")
+        if not options["force"]:
+            storages = storages.filter(photo_widths=[])
+
+        processed = 0
+        for storage in storages.iterator():
+            try:
+                widths = generate_photo_derivatives(storage)
+            except OSError as error:
+                self.stderr.write(f"Склад {storage.pk}: {error}")
+                continue
+            self.stdout.write(f"Склад {storage.pk}: {', '.join(map(str, widths))}")
+            processed += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Обработано складов: {processed}"))
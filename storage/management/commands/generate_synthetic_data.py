@@ -0,0 +1,245 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.utils.timezone import now
+
+from storage import cache as catalog_cache
+from storage.models import Storage, Box, Rent
+
+# Префикс номеров боксов, логинов и email сгенерированных записей
+PREFIX = "gen"
+PHOTO_SOURCE = "./static/img/image11.png"
+PHOTO_NAME = "storage_images/generated.png"
+PASSWORD = "password"
+
+CITIES = (
+    "Москва",
+    "Санкт-Петербург",
+    "Новосибирск",
+    "Екатеринбург",
+    "Казань",
+    "Нижний Новгород",
+    "Челябинск",
+    "Самара",
+    "Омск",
+    "Ростов-на-Дону",
+    "Уфа",
+    "Красноярск",
+    "Воронеж",
+    "Пермь",
+    "Волгоград",
+    "Одинцово",
+    "Пушкино",
+    "Люберцы",
+    "Домодедово",
+)
+STREETS = ("Ленина", "Советская", "Рокотова", "Строителей", "Серверная", "Мира")
+# Доля аренд пользователей; остальные аренды оформлены только по email
+USER_RENT_SHARE = 0.8
+# Доля отмененных аренд среди прошлых
+CANCELLED_SHARE = 0.15
+
+
+class Command(BaseCommand):
+    help = (
+        "Сгенерировать детерминированные тестовые данные большого объема: "
+        "склады, боксы, аренды во всех статусах и пользователей"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--storages", type=int, default=1_000)
+        parser.add_argument("--boxes", type=int, default=200_000)
+        parser.add_argument("--rents", type=int, default=2_000_000)
+        parser.add_argument("--users", type=int, default=500_000)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10_000,
+            help="Сколько записей создавать одним INSERT",
+        )
+
+    def handle(self, *args, **options):
+        if Box.objects.filter(number__startswith=f"{PREFIX}-").exists():
+            raise CommandError(
+                "Сгенерированные данные уже есть в базе, очистите ее перед запуском"
+            )
+
+        self.random = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        self.now = now()
+
+        user_ids = self.create_users(options["users"])
+        storage_ids = self.create_storages(options["storages"])
+        boxes = self.create_boxes(storage_ids, options["boxes"])
+        rents = self.create_rents(boxes, user_ids, options["rents"])
+
+        catalog_cache.bump_version()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Создано пользователей: {len(user_ids)}, складов: {len(storage_ids)}, "
+                f"боксов: {len(boxes)}, аренд: {rents}"
+            )
+        )
+
+    def chunks(self, count):
+        for start in range(0, count, self.batch_size):
+            yield range(start, min(start + self.batch_size, count))
+
+    def create_users(self, count) -> list:
+        # Хэш пароля вычисляется один раз: PBKDF2 для каждого пользователя
+        # занял бы часы
+        password = make_password(PASSWORD)
+        user_ids = []
+        for chunk in self.chunks(count):
+            users = User.objects.bulk_create(
+                User(
+                    username=f"{PREFIX}-user-{i}",
+                    email=f"{PREFIX}-user-{i}@example.com",
+                    password=password,
+                    date_joined=self.now,
+                )
+                for i in chunk
+            )
+            user_ids += [user.pk for user in users]
+        self.stdout.write(f"Пользователей: {len(user_ids)}")
+        return user_ids
+
+    def create_storages(self, count) -> list:
+        # Все склады ссылаются на одну фотографию, она загружается один раз
+        if not default_storage.exists(PHOTO_NAME):
+            with open(PHOTO_SOURCE, "rb") as photo:
+                default_storage.save(PHOTO_NAME, File(photo))
+
+        storages = Storage.objects.bulk_create(
+            (
+                Storage(
+                    photo=PHOTO_NAME,
+                    city=self.random.choice(CITIES),
+                    address=(
+                        f"ул. {self.random.choice(STREETS)}, "
+                        f"д. {self.random.randint(1, 200)}"
+                    ),
+                    temperature=self.random.randint(15, 22),
+                )
+                for _ in range(count)
+            ),
+            batch_size=self.batch_size,
+        )
+        self.stdout.write(f"Складов: {len(storages)}")
+        return [storage.pk for storage in storages]
+
+    def create_boxes(self, storage_ids, count) -> list:
+        """
+        Создает боксы и возвращает список пар (id, цена)
+        """
+        boxes = []
+        for chunk in self.chunks(count):
+            batch = []
+            for i in chunk:
+                width = round(self.random.uniform(2.0, 5.0), 1)
+                length = round(self.random.uniform(1.0, 4.0), 1)
+                batch.append(
+                    Box(
+                        number=f"{PREFIX}-{i}",
+                        storage_id=storage_ids[i % len(storage_ids)],
+                        level=self.random.randint(1, 4),
+                        height=round(self.random.uniform(2.0, 4.0), 1),
+                        width=width,
+                        length=length,
+                        # Box.save не вызывается, площадь считается здесь
+                        area=(Decimal(str(width)) * Decimal(str(length))).quantize(
+                            Decimal("0.1")
+                        ),
+                        price=self.random.randint(1000, 5000),
+                    )
+                )
+            boxes += [(box.pk, box.price) for box in Box.objects.bulk_create(batch)]
+        self.stdout.write(f"Боксов: {len(boxes)}")
+        return boxes
+
+    def generate_box_rents(self, box_id, price, count, user_ids) -> list:
+        """
+        Аренды одного бокса, идущие друг за другом без пересечений.
+
+        Занимать бокс (статусы created, active, expired) может только последняя
+        аренда, прошлые аренды завершены или отменены
+        """
+        rents = []
+        end_date = self.now + timedelta(days=self.random.randint(-60, 180))
+        for i in range(count):
+            start_date = end_date - timedelta(days=self.random.randint(30, 180))
+            if i == 0:
+                if end_date <= self.now:
+                    status = self.random.choice(("expired", "completed"))
+                elif start_date <= self.now:
+                    status = "active"
+                else:
+                    status = "created"
+            elif self.random.random() < CANCELLED_SHARE:
+                status = "cancelled"
+            else:
+                status = "completed"
+
+            if user_ids and self.random.random() < USER_RENT_SHARE:
+                user_index = self.random.randrange(len(user_ids))
+                user_id = user_ids[user_index]
+                email = f"{PREFIX}-user-{user_index}@example.com"
+            else:
+                user_id = None
+                email = f"{PREFIX}-guest-{box_id}-{i}@example.com"
+
+            rents.append(
+                Rent(
+                    box_id=box_id,
+                    user_id=user_id,
+                    email=email,
+                    status=status,
+                    start_date=start_date,
+                    end_date=end_date,
+                    # Rent.save не вызывается, стоимость считается так же, как в нем
+                    total_price=Rent.get_rental_price(
+                        price, Rent.get_rental_days(start_date, end_date)
+                    ),
+                )
+            )
+            end_date = start_date - timedelta(days=self.random.randint(0, 30))
+        return rents
+
+    def create_rents(self, boxes, user_ids, count) -> int:
+        created = 0
+        rents_per_box, extra_rents = divmod(count, len(boxes)) if boxes else (0, 0)
+        batch = []
+        occupied_box_ids = []
+        for index, (box_id, price) in enumerate(boxes):
+            box_rents = self.generate_box_rents(
+                box_id, price, rents_per_box + (index < extra_rents), user_ids
+            )
+            if box_rents and box_rents[0].status == "active":
+                occupied_box_ids.append(box_id)
+            batch += box_rents
+            if len(batch) >= self.batch_size or index == len(boxes) - 1:
+                created += self.save_rents(batch, occupied_box_ids)
+                batch = []
+                occupied_box_ids = []
+                self.stdout.write(f"Аренд: {created}")
+        return created
+
+    @transaction.atomic
+    def save_rents(self, rents, occupied_box_ids) -> int:
+        rents = Rent.objects.bulk_create(rents)
+        # created_at заполняется при вставке текущим временем (auto_now_add),
+        # а напоминания рассчитывают на дату создания аренды
+        Rent.objects.filter(pk__in=[rent.pk for rent in rents]).update(
+            created_at=F("start_date"), updated_at=F("start_date")
+        )
+        Box.objects.filter(pk__in=occupied_box_ids).update(is_occupied=True)
+        return len(rents)
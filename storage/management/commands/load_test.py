@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from storage.load_test import LoadTestError, run_load_test
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест запущенных серверов: число запросов в секунду "
+        "и время ответа (p50, p95) под одновременной нагрузкой. "
+        "Например, сравнение WSGI и ASGI: load_test "
+        "http://localhost:8000/get_boxes/1/ http://localhost:8080/get_boxes/1/"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("urls", nargs="+", help="Адреса для сравнения")
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument(
+            "--timeout", type=float, default=30, help="Таймаут запроса, с"
+        )
+
+    def handle(self, *args, **options):
+        results = {}
+        for url in options["urls"]:
+            try:
+                results[url] = run_load_test(
+                    url,
+                    options["requests"],
+                    options["concurrency"],
+                    options["timeout"],
+                )
+            except LoadTestError as error:
+                raise CommandError(error)
+
+        width = max(len(url) for url in results) + 2
+        self.stdout.write(
+            f"{'Адрес':<{width}}{'запр/с':>10}{'p50, мс':>10}{'p95, мс':>10}"
+            f"{'ошибки':>8}"
+        )
+        for url, result in results.items():
+            self.stdout.write(
+                f"{url:<{width}}{result['rps']:>10}{result['p50_ms']:>10}"
+                f"{result['p95_ms']:>10}{result['errors']:>8}"
+            )
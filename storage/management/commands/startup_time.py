@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from storage.benchmarks import (
+    STARTUP_LAZY_MODULES,
+    get_eager_modules,
+    get_heaviest_imports,
+    measure_startup,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Замерить время холодного запуска: django.setup(), загрузку WSGI и ASGI "
+        "приложений и URLconf, показать самые долгие импорты и проверить, "
+        f"что при запуске не загружаются {', '.join(STARTUP_LAZY_MODULES)}"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5)
+        parser.add_argument(
+            "--top", type=int, default=10, help="Сколько пакетов показать"
+        )
+        parser.add_argument(
+            "--max-ms",
+            type=float,
+            help="Бюджет p50 загрузки WSGI-приложения, мс",
+        )
+
+    def handle(self, *args, **options):
+        results = measure_startup(options["runs"])
+
+        self.stdout.write(f"{'Этап':<16}{'p50, мс':>10}{'мин, мс':>10}")
+        for stage, result in results.items():
+            self.stdout.write(
+                f"{stage:<16}{result['p50_ms']:>10}{result['min_ms']:>10}"
+            )
+
+        self.stdout.write(
+            "\nСамые долгие импорты пакетов при загрузке WSGI-приложения, мс:"
+        )
+        for module, duration_ms in get_heaviest_imports(options["top"]):
+            self.stdout.write(f"{module:<40}{duration_ms:>10}")
+
+        errors = []
+        eager_modules = get_eager_modules()
+        if eager_modules:
+            errors.append(f"при запуске загружаются {', '.join(eager_modules)}")
+        max_ms = options["max_ms"]
+        if max_ms is not None and results["wsgi"]["p50_ms"] > max_ms:
+            errors.append(f"wsgi: p50_ms = {results['wsgi']['p50_ms']} > {max_ms}")
+        if errors:
+            raise CommandError("; ".join(errors))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from storage.sweeps import BATCH_SIZE, sweep_rents
+
+
+class Command(BaseCommand):
+    help = (
+        "Отправить напоминания об окончании аренды, перевести истекшие аренды "
+        "в статус 'просрочено' и напомнить о просроченных арендах"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=BATCH_SIZE,
+            help="Сколько аренд обрабатывать за один UPDATE",
+        )
+
+    def handle(self, *args, **options):
+        result = sweep_rents(options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Напоминаний: {result['reminders']}, "
+                f"просрочено аренд: {result['expired']}, "
+                f"напоминаний о просрочке: {result['overdue_reminders']}"
+            )
+        )
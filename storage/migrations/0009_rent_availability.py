@@ -0,0 +1,87 @@
+# Generated by Django 5.1.5 on 2026-10-18 09:22
+
+from django.db import migrations, models
+from django.db.models import Exists, F, OuterRef
+
+BLOCKING_STATUSES = ("created", "active", "expired")
+
+CREATE_EXCLUSION_CONSTRAINT = """
+    CREATE EXTENSION IF NOT EXISTS btree_gist;
+    ALTER TABLE storage_rent ADD CONSTRAINT storage_rent_box_period_excl
+        EXCLUDE USING gist (
+            box_id WITH =,
+            tstzrange(start_date, end_date, '[)') WITH &&
+        )
+        WHERE (status IN ('created', 'active', 'expired'));
+"""
+
+DROP_EXCLUSION_CONSTRAINT = """
+    ALTER TABLE storage_rent DROP CONSTRAINT IF EXISTS storage_rent_box_period_excl;
+"""
+
+
+def cancel_overlapping_rents(apps, schema_editor):
+    """
+    Отменяет аренды, которые не дают создать ограничение: раньше один бокс
+    можно было забронировать на пересекающиеся даты.
+
+    Из пересекающихся аренд бокса остается созданная раньше, более поздние
+    отменяются. Отменяются и аренды с окончанием раньше начала: для них
+    нельзя построить tstzrange
+    """
+    Rent = apps.get_model("storage", "Rent")
+    blocking = Rent.objects.filter(status__in=BLOCKING_STATUSES)
+    blocking.filter(end_date__lt=F("start_date")).update(status="cancelled")
+
+    overlapping = blocking.filter(
+        box=OuterRef("box"),
+        start_date__lt=OuterRef("end_date"),
+        end_date__gt=OuterRef("start_date"),
+    ).exclude(pk=OuterRef("pk"))
+    conflicting = blocking.filter(Exists(overlapping)).order_by("box_id", "id")
+
+    cancelled_ids = []
+    kept = {}
+    for rent in conflicting.only("id", "box_id", "start_date", "end_date"):
+        periods = kept.setdefault(rent.box_id, [])
+        if any(
+            rent.start_date < end_date and rent.end_date > start_date
+            for start_date, end_date in periods
+        ):
+            cancelled_ids.append(rent.id)
+        else:
+            periods.append((rent.start_date, rent.end_date))
+    Rent.objects.filter(id__in=cancelled_ids).update(status="cancelled")
+
+
+def create_exclusion_constraint(apps, schema_editor):
+    """
+    Запрещает пересекающиеся аренды одного бокса на уровне БД.
+    Ограничения с GiST есть только в PostgreSQL
+    """
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(CREATE_EXCLUSION_CONSTRAINT)
+
+
+def drop_exclusion_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(DROP_EXCLUSION_CONSTRAINT)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("storage", "0008_alter_rent_is_delivery_needed"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="rent",
+            index=models.Index(
+                fields=["box", "start_date", "end_date"],
+                name="storage_rent_box_period_idx",
+            ),
+        ),
+        migrations.RunPython(cancel_overlapping_rents, migrations.RunPython.noop),
+        migrations.RunPython(create_exclusion_constraint, drop_exclusion_constraint),
+    ]
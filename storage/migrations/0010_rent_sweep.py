@@ -0,0 +1,55 @@
+# Generated by Django 5.1.5 on 2026-10-18 09:25
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def mark_rents_with_scheduled_tasks(apps, schema_editor):
+    """
+    У существующих аренд напоминания и смена статуса уже запланированы
+    отдельными задачами, sweep_rents_task не должен дублировать их письма
+    """
+    Rent = apps.get_model("storage", "Rent")
+    Rent.objects.filter(status__in=["created", "active"]).update(reminder_days_sent=0)
+    Rent.objects.filter(status="expired").update(overdue_reminded_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("storage", "0009_rent_availability"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="rent",
+            name="overdue_reminded_at",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="Дата напоминания о просрочке"
+            ),
+        ),
+        migrations.AddField(
+            model_name="rent",
+            name="reminder_days_sent",
+            field=models.PositiveSmallIntegerField(
+                blank=True,
+                null=True,
+                verbose_name="Последнее напоминание, дней до окончания",
+            ),
+        ),
+        migrations.RunPython(
+            mark_rents_with_scheduled_tasks, migrations.RunPython.noop
+        ),
+        migrations.RemoveField(
+            model_name="rent",
+            name="task_ids",
+        ),
+        migrations.AddIndex(
+            model_name="rent",
+            index=models.Index(
+                fields=["status", "end_date"], name="storage_rent_status_end_idx"
+            ),
+        ),
+    ]
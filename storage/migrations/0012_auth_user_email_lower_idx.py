@@ -0,0 +1,21 @@
+# Generated by Django 5.1.5 on 2026-10-18 10:05
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("storage", "0011_outboxemail"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Индекс для входа по email без учета регистра (UserEmailBackend)
+        migrations.RunSQL(
+            sql="CREATE INDEX IF NOT EXISTS storage_auth_user_email_lower_idx "
+            "ON auth_user (LOWER(email));",
+            reverse_sql="DROP INDEX IF EXISTS storage_auth_user_email_lower_idx;",
+        ),
+    ]
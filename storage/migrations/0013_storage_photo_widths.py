@@ -0,0 +1,23 @@
+# Generated by Django 5.1.5 on 2026-10-18 09:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("storage", "0012_auth_user_email_lower_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="storage",
+            name="photo_widths",
+            field=models.JSONField(
+                blank=True,
+                default=list,
+                editable=False,
+                verbose_name="Ширины уменьшенных копий фото",
+            ),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.5 on 2026-10-18 09:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("storage", "0013_storage_photo_widths"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="rent",
+            index=models.Index(
+                fields=["user", "-end_date", "-id"], name="storage_rent_user_end_idx"
+            ),
+        ),
+    ]
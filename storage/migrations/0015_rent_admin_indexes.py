@@ -0,0 +1,57 @@
+# Generated by Django 5.1.5 on 2026-10-18 10:41
+
+from django.db import migrations, models
+
+END_DATE_INDEX = models.Index(fields=["end_date"], name="storage_rent_end_idx")
+
+# Индекс для поиска аренд по началу email без учета регистра в админке
+CREATE_EMAIL_INDEX = """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS storage_rent_email_lower_idx
+        ON storage_rent (LOWER(email) varchar_pattern_ops);
+"""
+
+DROP_EMAIL_INDEX = """
+    DROP INDEX CONCURRENTLY IF EXISTS storage_rent_email_lower_idx;
+"""
+
+
+def create_indexes(apps, schema_editor):
+    """
+    В PostgreSQL индексы строятся без блокировки записи в таблицу аренд
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        schema_editor.add_index(apps.get_model("storage", "Rent"), END_DATE_INDEX)
+        return
+    schema_editor.execute(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS storage_rent_end_idx "
+        "ON storage_rent (end_date);"
+    )
+    schema_editor.execute(CREATE_EMAIL_INDEX)
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        schema_editor.remove_index(apps.get_model("storage", "Rent"), END_DATE_INDEX)
+        return
+    schema_editor.execute("DROP INDEX CONCURRENTLY IF EXISTS storage_rent_end_idx;")
+    schema_editor.execute(DROP_EMAIL_INDEX)
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY нельзя выполнять в транзакции
+    atomic = False
+
+    dependencies = [
+        ("storage", "0014_rent_user_end_idx"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name="rent", index=END_DATE_INDEX),
+            ],
+            database_operations=[
+                migrations.RunPython(create_indexes, drop_indexes),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.5 on 2026-10-18 10:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("storage", "0015_rent_admin_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="outboxemail",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "В очереди"),
+                    ("sending", "Отправляется"),
+                    ("sent", "Отправлено"),
+                    ("failed", "Не отправлено"),
+                ],
+                default="pending",
+                max_length=20,
+                verbose_name="Статус",
+            ),
+        ),
+    ]
@@ -1,17 +1,46 @@
 from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal
 
 from django.contrib.auth.models import User
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import (
+    Count,
+    Exists,
+    ExpressionWrapper,
+    F,
+    Max,
+    Min,
+    OuterRef,
+    Q,
+    Value,
+)
+from django.db.models.functions import Concat
 from django.utils.timezone import now
 from phonenumber_field.modelfields import PhoneNumberField
 
 import storage.messages as msg
-from sigvard.celery import app
-from .tasks import (
-    send_email_message_task,
-    send_monthly_email_reminder,
-    set_rent_status_to_expired_task,
-)
+from storage.cache import bump_storage_version_on_commit, bump_user_version_on_commit
+
+
+class StorageQuerySet(models.QuerySet):
+    def with_box_stats(self):
+        """
+        Аннотирует склады сводкой по боксам: всего, занято, свободно,
+        минимальная цена и максимальная высота.
+
+        Все значения считаются одним запросом, независимо от количества складов.
+        Занятые боксы считаются фильтром агрегата с проверкой EXISTS по индексу
+        аренд бокса: коррелированный подзапрос по складу попадал в GROUP BY
+        и выполнялся заново для каждого бокса.
+        """
+        active_rents = Rent.objects.filter(box=OuterRef("boxes"), status="active")
+        return self.annotate(
+            total_boxes=Count("boxes"),
+            occupied_boxes=Count("boxes", filter=Q(Exists(active_rents))),
+            min_price=Min("boxes__price"),
+            max_height=Max("boxes__height"),
+        ).annotate(available_boxes=F("total_boxes") - F("occupied_boxes"))
 
 
 class Storage(models.Model):
@@ -22,6 +51,14 @@ class Storage(models.Model):
     contact = models.CharField(max_length=255, verbose_name="Контакты", blank=True)
     description = models.CharField(max_length=1024, verbose_name="Описание", blank=True)
     directions = models.CharField(max_length=255, verbose_name="Проезд", blank=True)
+    photo_widths = models.JSONField(
+        default=list,
+        blank=True,
+        editable=False,
+        verbose_name="Ширины уменьшенных копий фото",
+    )
+
+    objects = StorageQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Склад"
@@ -30,6 +67,49 @@ class Storage(models.Model):
     def __str__(self):
         return f"{self.city}, {self.address}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if "photo" in field_names:
+            instance._loaded_photo = instance.photo.name
+        return instance
+
+    def save(self, *args, **kwargs):
+        photo_changed = self.photo.name != getattr(self, "_loaded_photo", None)
+        if photo_changed:
+            # Копии прежней фотографии больше не подходят
+            self.photo_widths = []
+        super().save(*args, **kwargs)
+        self._loaded_photo = self.photo.name
+
+        if photo_changed and self.photo:
+            # Задачи импортируются при отправке: импорт моделей
+            # не должен загружать Celery
+            from .tasks import generate_photo_derivatives_task
+
+            storage_id = self.pk
+            transaction.on_commit(
+                lambda: generate_photo_derivatives_task.delay(storage_id)
+            )
+
+
+class BoxQuerySet(models.QuerySet):
+    def available_between(self, start_date, end_date):
+        """
+        Боксы, которые можно занять на период [start_date, end_date)
+        (см. RentQuerySet.occupying)
+        """
+        occupying_rents = Rent.objects.occupying(start_date, end_date)
+        return self.exclude(Exists(occupying_rents.filter(box=OuterRef("pk"))))
+
+    def update_occupancy(self) -> int:
+        """
+        Пересчитывает is_occupied одним UPDATE: бокс занят, пока у него
+        есть активная аренда (так же считает Storage.with_box_stats)
+        """
+        active_rents = Rent.objects.filter(box=OuterRef("pk"), status="active")
+        return self.update(is_occupied=Exists(active_rents))
+
 
 class Box(models.Model):
     number = models.CharField(
@@ -50,6 +130,8 @@ class Box(models.Model):
     )
     is_occupied = models.BooleanField(verbose_name="Занята", default=False)
 
+    objects = BoxQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Бокс"
         verbose_name_plural = "Боксы"
@@ -62,7 +144,74 @@ class Box(models.Model):
         super().save(*args, **kwargs)
 
 
+class RentStatusConflict(Exception):
+    """
+    Статус аренды изменен параллельно с текущим изменением
+    """
+
+
+class RentQuerySet(models.QuerySet):
+    def blocking(self):
+        """
+        Аренды, которые занимают бокс на свой период
+        """
+        return self.filter(status__in=Rent.BLOCKING_STATUSES)
+
+    def overlapping(self, start_date, end_date):
+        """
+        Аренды, период которых пересекается с [start_date, end_date)
+        """
+        return self.filter(start_date__lt=end_date, end_date__gt=start_date)
+
+    def occupying(self, start_date, end_date):
+        """
+        Аренды, из-за которых бокс нельзя занять на [start_date, end_date):
+        блокирующие аренды с пересекающимся периодом и просроченные аренды,
+        начавшиеся раньше end_date. Просроченная аренда длится, пока ее
+        не завершат: вещи клиента остаются в боксе и после end_date
+        """
+        return self.blocking().filter(
+            Q(end_date__gt=start_date) | Q(status="expired"), start_date__lt=end_date
+        )
+
+    def history(self):
+        """
+        Завершенные и отмененные аренды
+        """
+        return self.exclude(status__in=Rent.BLOCKING_STATUSES)
+
+    def for_dashboard(self):
+        """
+        Аренды для личного кабинета в виде словарей: номер бокса, склад
+        и признак того, что срок аренды подходит к концу
+        """
+        return self.values(
+            "id",
+            "status",
+            "start_date",
+            "end_date",
+            box_number=F("box__number"),
+            storage_id=F("box__storage_id"),
+            storage_name=Concat(
+                "box__storage__city", Value(", "), "box__storage__address"
+            ),
+            is_near_end=ExpressionWrapper(
+                Q(end_date__lte=now() + Rent.NEAR_END_PERIOD),
+                output_field=models.BooleanField(),
+            ),
+        )
+
+
 class Rent(models.Model):
+    # Статусы, при которых бокс занят на период аренды.
+    # Должны совпадать с условием ограничения storage_rent_box_period_excl
+    BLOCKING_STATUSES = ("created", "active", "expired")
+    # За сколько до окончания аренды в личном кабинете показывается предупреждение
+    NEAR_END_PERIOD = timedelta(days=7)
+    # Цена бокса указана за месяц из стольких дней
+    DAYS_IN_MONTH = 30
+    # Точность поля total_price
+    CENT = Decimal("0.01")
     RENT_STATUS_CHOICES = (
         ("created", "Создана"),
         ("active", "Активна"),
@@ -70,6 +219,14 @@ class Rent(models.Model):
         ("cancelled", "Отменена"),
         ("expired", "Просрочена"),
     )
+    # Допустимые переходы между статусами
+    STATUS_TRANSITIONS = {
+        "created": ("active", "cancelled", "expired"),
+        "active": ("completed", "cancelled", "expired"),
+        "expired": ("active", "completed", "cancelled"),
+        "completed": (),
+        "cancelled": (),
+    }
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -106,27 +263,121 @@ class Rent(models.Model):
     is_partial_pickup_allowed = models.BooleanField(
         default=False, verbose_name="Можно забирать частично"
     )
-    task_ids = models.JSONField(default=list, verbose_name="ID задач напоминаний")
+    reminder_days_sent = models.PositiveSmallIntegerField(
+        verbose_name="Последнее напоминание, дней до окончания", null=True, blank=True
+    )
+    overdue_reminded_at = models.DateTimeField(
+        verbose_name="Дата напоминания о просрочке", null=True, blank=True
+    )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
 
-    def save(self, *args, **kwargs):
-        is_new = self.pk is None
-        if is_new:
-            # Действия, выполняемые при создании записи
-            super().save(*args, **kwargs)
-            self.send_confirm_rent_message()
-            self.set_rent_status_to_expired()
-            self.schedule_rent_reminders()
-        else:
-            # Действия, выполняемые при обновлении записи
-            self.handle_status_changes()
+    objects = RentQuerySet.as_manager()
+
+    # Статус и дата окончания, с которыми аренда была загружена из БД
+    _loaded_status = None
+    _loaded_end_date = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if "status" in field_names:
+            instance._loaded_status = instance.status
+        if "end_date" in field_names:
+            instance._loaded_end_date = instance.end_date
+        return instance
+
+    def clean(self):
+        """
+        Проверяет переход статуса и то, что бокс свободен на период аренды
+        """
+        if (
+            self._loaded_status
+            and self._loaded_status != self.status
+            and self.status not in self.STATUS_TRANSITIONS[self._loaded_status]
+        ):
+            old_status_display = dict(self.RENT_STATUS_CHOICES)[self._loaded_status]
+            raise ValidationError(
+                {
+                    "status": f"Нельзя изменить статус аренды с «{old_status_display}» "
+                    f"на «{self.get_status_display()}»."
+                }
+            )
+        if not (self.start_date and self.end_date):
+            return
+        if self.end_date <= self.start_date:
+            raise ValidationError(
+                {"end_date": "Дата окончания аренды должна быть позже даты начала."}
+            )
+        if self.box_id and self.status in self.BLOCKING_STATUSES:
+            if self._state.adding:
+                overlapping_rents = Rent.objects.occupying(
+                    self.start_date, self.end_date
+                )
+            else:
+                # Бронирование, сделанное до просрочки предыдущей аренды,
+                # остается редактируемым
+                overlapping_rents = Rent.objects.blocking().overlapping(
+                    self.start_date, self.end_date
+                )
+            overlapping_rents = overlapping_rents.filter(box_id=self.box_id).exclude(
+                pk=self.pk
+            )
+            if overlapping_rents.exists():
+                raise ValidationError({"box": "Бокс занят на выбранные даты."})
 
+    def save(self, *args, **kwargs):
         self.set_delivery_flag()
         self.calculate_rental_price()
         self.link_user_by_email()
 
-        super().save(*args, **kwargs)
+        if self.pk is None:
+            # Действия, выполняемые при создании записи.
+            # Письмо записывается в очередь в той же транзакции, напоминания
+            # и смену статуса в конце срока выполняет sweep_rents_task
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                self.send_confirm_rent_message()
+        else:
+            # Действия, выполняемые при обновлении записи.
+            if self._loaded_end_date and self._loaded_end_date != self.end_date:
+                # Срок аренды изменен, напоминания отправляются заново
+                self.reminder_days_sent = None
+
+            # Смена статуса проходит через условный переход, чтобы параллельное
+            # изменение статуса не выполнило побочные действия дважды
+            with transaction.atomic():
+                old_status = self._loaded_status or (
+                    Rent.objects.filter(pk=self.pk)
+                    .values_list("status", flat=True)
+                    .first()
+                )
+                new_status = self.status
+                if old_status and old_status != new_status:
+                    self.status = old_status
+                    if not self.transition_to(new_status):
+                        raise RentStatusConflict(
+                            f"Статус аренды №{self.pk} уже изменен другим запросом"
+                        )
+                # Статус записывается только переходом: полная запись строки
+                # вернула бы статус, загруженный до параллельного перехода
+                # (например, просрочки в sweep_rents_task)
+                update_fields = kwargs.pop("update_fields", None)
+                if update_fields is None:
+                    update_fields = [
+                        field.attname
+                        for field in self._meta.concrete_fields
+                        if not field.primary_key
+                    ]
+                super().save(
+                    *args,
+                    update_fields=[
+                        field for field in update_fields if field != "status"
+                    ],
+                    **kwargs,
+                )
+        self._loaded_status = self.status
+        self._loaded_end_date = self.end_date
 
     # Вспомогательные методы
 
@@ -134,12 +385,34 @@ class Rent(models.Model):
         """Устанавливает флаг необходимости доставки, если указан адрес забора груза"""
         self.is_delivery_needed = True if self.pickup_address else False
 
+    @staticmethod
+    def get_rental_days(start_date, end_date) -> int:
+        """
+        Число оплачиваемых дней аренды. Период аренды [start_date, end_date):
+        в день окончания бокс уже свободен для следующей аренды
+        (см. RentQuerySet.overlapping и storage_rent_box_period_excl),
+        поэтому этот день не оплачивается
+        """
+        return (end_date - start_date).days
+
+    @classmethod
+    def get_rental_price(cls, monthly_price, rental_days):
+        """
+        Стоимость аренды на rental_days дней бокса с ценой monthly_price
+        за месяц, округленная до копеек.
+
+        Округление половины вверх (от нуля), как у numeric в PostgreSQL:
+        Decimal по умолчанию округляет половину к четному, и расчет
+        стоимости расходился бы с сохраненной арендой на копейку
+        """
+        total_price = Decimal(monthly_price) * rental_days / cls.DAYS_IN_MONTH
+        return total_price.quantize(cls.CENT, rounding=ROUND_HALF_UP)
+
     def calculate_rental_price(self):
         """Рассчитывает стоимость аренды, если заданы даты"""
         if self.start_date and self.end_date:
-            rental_days = (self.end_date - self.start_date).days + 1
-            daily_price = self.box.price / 30
-            self.total_price = rental_days * daily_price
+            rental_days = self.get_rental_days(self.start_date, self.end_date)
+            self.total_price = self.get_rental_price(self.box.price, rental_days)
 
     def link_user_by_email(self):
         """Связывает аренду с пользователем, если указан email"""
@@ -152,65 +425,158 @@ class Rent(models.Model):
     def send_confirm_rent_message(self):
         """Отправляет письмо подтверждение создания заказа аренды"""
         subject, message = msg.create_confirm_rent_message(self)
-        send_email_message_task.delay(subject, message, self.email)
+        OutboxEmail.objects.queue([(subject, message, self.email)])
 
-    def set_rent_status_to_expired(self):
-        """Запланировать задачу изменить статус на 'просрочено' в конце срока аренды"""
-        task = set_rent_status_to_expired_task.apply_async(
-            (self.pk,),
-            countdown=(self.end_date - now()).total_seconds(),
-        )
-        self.task_ids.append(task.id)
-
-    def schedule_rent_reminders(self) -> list:
-        """Запланировать задачи для периодических напоминаний об окончании аренды."""
-        delays = {30: "месяц", 14: "2 недели", 7: "неделю", 3: "3 дня"}
-        for delay, time_insert in delays.items():
-            countdown = (self.end_date - timedelta(days=delay) - now()).total_seconds()
-            if countdown > 0:
-                subject, message = msg.create_notif_end_rent_message(self, time_insert)
-                task = send_email_message_task.apply_async(
-                    (subject, message, self.email), countdown=countdown
-                )
-                self.task_ids.append(task.id)
-
-    def handle_status_changes(self):
-        """Обрабатывает изменения статуса аренды"""
-        old_status = Rent.objects.get(pk=self.pk).status
-        new_status = self.status
-
-        # Если статус изменился
-        if old_status != new_status:
-            if new_status in ["completed", "cancelled"]:
-                self.remove_related_tasks()
-                self.free_box()
-            elif new_status == "expired":
-                self.schedule_reminder_for_overdue_rent()
-            elif new_status == "active":
-                self.occupy_box()
-
-    def remove_related_tasks(self):
-        """Удаляет связанные задачи, если аренда завершена или отменена"""
-        for task_id in self.task_ids:
-            app.control.revoke(task_id, terminate=True)
-        self.task_ids = []
-
-    def schedule_reminder_for_overdue_rent(self):
-        """Запланировать напоминание об просроченной аренде"""
-        subject, message = msg.create_reminder_for_overdue_rent_message(self)
-        send_monthly_email_reminder.delay(self.pk, subject, message)
-
-    def occupy_box(self):
-        self.box.is_occupied = True
-        self.box.save()
-
-    def free_box(self):
-        self.box.is_occupied = False
-        self.box.save()
+    # Переходы статусов
+
+    def can_transition_to(self, new_status) -> bool:
+        return new_status in self.STATUS_TRANSITIONS[self.status]
+
+    def transition_to(self, new_status) -> bool:
+        """
+        Переводит аренду в статус new_status условным UPDATE ... WHERE status=<текущий>.
+
+        Возвращает False, если статус аренды успели изменить параллельно,
+        тогда побочные действия перехода не выполняются
+        """
+        old_status = self.status
+        if not self.can_transition_to(new_status):
+            raise ValueError(
+                f"Недопустимый переход статуса аренды: {old_status} -> {new_status}"
+            )
+
+        changes = {"status": new_status, "updated_at": now()}
+        if new_status == "active":
+            # При следующей просрочке напоминание отправляется сразу
+            changes["overdue_reminded_at"] = None
+
+        with transaction.atomic():
+            updated = Rent.objects.filter(pk=self.pk, status=old_status).update(
+                **changes
+            )
+            if updated:
+                for field, value in changes.items():
+                    setattr(self, field, value)
+                self._loaded_status = new_status
+                self.handle_status_changes(old_status, new_status)
+                # UPDATE по queryset не вызывает post_save, кэш каталога
+                # и личного кабинета инвалидируется здесь
+                bump_storage_version_on_commit(self.box.storage_id)
+                if self.user_id:
+                    bump_user_version_on_commit(self.user_id)
+
+        return bool(updated)
+
+    def activate(self) -> bool:
+        return self.transition_to("active")
+
+    def complete(self) -> bool:
+        return self.transition_to("completed")
+
+    def cancel(self) -> bool:
+        return self.transition_to("cancelled")
+
+    def expire(self) -> bool:
+        return self.transition_to("expired")
+
+    def handle_status_changes(self, old_status, new_status):
+        """
+        Обрабатывает изменения статуса аренды.
+        Напоминания о просрочке отправляет sweep_rents_task
+        """
+        if "active" in (old_status, new_status):
+            # Занятость пересчитывается по всем арендам бокса: отмена или
+            # завершение аренды, которая бокс не занимала, не должна
+            # освобождать его от другой, активной аренды
+            Box.objects.filter(pk=self.box_id).update_occupancy()
 
     class Meta:
         verbose_name = "Аренда"
         verbose_name_plural = "Аренды"
+        indexes = [
+            models.Index(
+                fields=["status", "end_date"], name="storage_rent_status_end_idx"
+            ),
+            models.Index(
+                fields=["box", "start_date", "end_date"],
+                name="storage_rent_box_period_idx",
+            ),
+            # Навигация по датам окончания в админке
+            models.Index(fields=["end_date"], name="storage_rent_end_idx"),
+            # История аренд в личном кабинете: страницы по (end_date, id)
+            models.Index(
+                fields=["user", "-end_date", "-id"], name="storage_rent_user_end_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"Аренда бокса {self.box.number} пользователем {self.email}"
+
+
+class OutboxEmailQuerySet(models.QuerySet):
+    def queue(self, emails) -> list:
+        """
+        Записывает письма (тема, текст, адрес) в очередь одним INSERT.
+        Отправка запускается после фиксации транзакции
+        """
+        outbox_emails = self.bulk_create(
+            OutboxEmail(subject=subject, body=message, to=email)
+            for subject, message, email in emails
+            if email
+        )
+        if outbox_emails:
+            from .tasks import send_outbox_emails_task
+
+            transaction.on_commit(send_outbox_emails_task.delay)
+        return outbox_emails
+
+    def due(self):
+        """
+        Письма, которые пора отправить: ожидающие очереди и те, что
+        были взяты на отправку, но не отправлены вовремя (воркер упал)
+        """
+        return self.filter(
+            status__in=["pending", "sending"], next_attempt_at__lte=now()
+        )
+
+
+class OutboxEmail(models.Model):
+    STATUS_CHOICES = (
+        ("pending", "В очереди"),
+        ("sending", "Отправляется"),
+        ("sent", "Отправлено"),
+        ("failed", "Не отправлено"),
+    )
+    subject = models.CharField(max_length=255, verbose_name="Тема")
+    body = models.TextField(verbose_name="Текст")
+    to = models.EmailField(verbose_name="Получатель")
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default="pending",
+        verbose_name="Статус",
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0, verbose_name="Попыток отправки"
+    )
+    last_error = models.TextField(blank=True, verbose_name="Последняя ошибка")
+    next_attempt_at = models.DateTimeField(
+        default=now, verbose_name="Следующая попытка"
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="Дата отправки")
+
+    objects = OutboxEmailQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Письмо"
+        verbose_name_plural = "Очередь писем"
+        indexes = [
+            models.Index(
+                fields=["status", "next_attempt_at"],
+                name="storage_outbox_due_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} ({self.to})"
@@ -0,0 +1,37 @@
+"""
+Разметка, которая рендерится один раз на процесс.
+
+Разметка рендерится без запроса, только из переданного контекста:
+контекстные процессоры не выполняются, и в разметку, общую для всех
+посетителей, не попадают данные первого запроса (пользователь, сообщения,
+путь). CSRF-токен заменен заглушкой и подставляется в готовый HTML
+на каждый запрос.
+"""
+
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+CSRF_TOKEN_PLACEHOLDER = "__csrf_token_placeholder__"
+
+# Отрендеренная разметка по ключу. Шаблоны меняются только с новой версией
+# приложения, поэтому разметка хранится в памяти процесса
+prerendered = {}
+
+
+def prerender(key, template_name, context=None) -> str:
+    """
+    Рендерит шаблон с заглушкой вместо CSRF-токена или берет готовую разметку
+    """
+    if key not in prerendered:
+        prerendered[key] = render_to_string(
+            template_name, {**(context or {}), "csrf_token": CSRF_TOKEN_PLACEHOLDER}
+        )
+    return prerendered[key]
+
+
+def insert_csrf_token(html, request) -> str:
+    """
+    Подставляет CSRF-токен запроса в разметку вместо заглушки
+    """
+    return mark_safe(html.replace(CSRF_TOKEN_PLACEHOLDER, get_token(request)))
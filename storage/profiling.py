@@ -0,0 +1,210 @@
+"""
+Легкий профайлер запросов для production.
+
+RequestProfilingMiddleware считает для каждого запроса число SQL-запросов
+и время в БД, время рендеринга шаблонов и время представления. Значения
+отдаются в заголовке Server-Timing (их видно во вкладке Network браузера)
+и пишутся в лог: каждый запрос с вероятностью PROFILING_SAMPLE_RATE
+и каждый медленный запрос вместе с самыми долгими SQL-запросами.
+
+SQL-запросы считает обертка, которая добавляется к каждому соединению
+с БД при его открытии; замеры текущего запроса она находит через
+contextvar, поэтому учитываются и запросы асинхронного ORM, выполняемые
+в других потоках. Время шаблонов считает бэкенд ProfiledDjangoTemplates;
+вложенные рендеры (render_to_string в шаблонных тегах) входят во время
+внешнего.
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import random
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger(__name__)
+
+# Сколько самых долгих SQL-запросов пишется в лог медленного запроса
+TOP_QUERIES = 5
+# Длина текста SQL-запроса в логе
+MAX_SQL_LENGTH = 1000
+
+current_profile = ContextVar("current_profile", default=None)
+
+
+def elapsed_ms(started) -> float:
+    return (time.perf_counter() - started) * 1000
+
+
+class RequestProfile:
+    """
+    Замеры одного запроса
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.queries = 0
+        self.db_ms = 0.0
+        self.template_ms = 0.0
+        self.rendering = False
+        # Самые долгие SQL-запросы: куча из (время, номер, текст)
+        self.top_queries = []
+        self.counter = itertools.count()
+
+    def record_query(self, sql, duration_ms):
+        self.queries += 1
+        self.db_ms += duration_ms
+        entry = (duration_ms, next(self.counter), sql)
+        if len(self.top_queries) < TOP_QUERIES:
+            heapq.heappush(self.top_queries, entry)
+        elif duration_ms > self.top_queries[0][0]:
+            heapq.heapreplace(self.top_queries, entry)
+
+
+def profile_query(execute, sql, params, many, context):
+    """
+    Обертка выполнения SQL-запросов (connection.execute_wrapper)
+    """
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.record_query(sql, elapsed_ms(started))
+
+
+@receiver(connection_created)
+def install_query_profiler(sender, connection, **kwargs):
+    # С пулом соединений сигнал приходит при каждой выдаче соединения
+    if profile_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(profile_query)
+
+
+class ProfiledTemplate:
+    """
+    Шаблон, время рендеринга которого учитывается в замерах запроса
+    """
+
+    def __init__(self, template):
+        self._template = template
+
+    def __getattr__(self, name):
+        return getattr(self._template, name)
+
+    def render(self, context=None, request=None):
+        profile = current_profile.get()
+        if profile is None or profile.rendering:
+            return self._template.render(context, request)
+
+        profile.rendering = True
+        started = time.perf_counter()
+        try:
+            return self._template.render(context, request)
+        finally:
+            profile.rendering = False
+            profile.template_ms += elapsed_ms(started)
+
+
+class ProfiledDjangoTemplates(DjangoTemplates):
+    """
+    Бэкенд шаблонов Django, который замеряет время рендеринга
+    """
+
+    def from_string(self, template_code):
+        return ProfiledTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return ProfiledTemplate(super().get_template(template_name))
+
+
+def start_view():
+    profile = current_profile.get()
+    if profile is not None:
+        profile.view_started = time.perf_counter()
+
+
+class RequestProfilingMiddleware:
+    """
+    Замеряет запрос и добавляет к ответу заголовок Server-Timing
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE
+        self.slow_request_ms = settings.PROFILING_SLOW_REQUEST_MS
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+            # Синхронный process_view в ASGI выполнялся бы в отдельном потоке
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.finish(request, response, profile)
+
+    def finish(self, request, response, profile):
+        total_ms = elapsed_ms(profile.started)
+        view_ms = elapsed_ms(profile.view_started) if profile.view_started else 0.0
+        response["Server-Timing"] = ", ".join(
+            (
+                f'db;dur={profile.db_ms:.1f};desc="{profile.queries} SQL"',
+                f"tpl;dur={profile.template_ms:.1f}",
+                f"view;dur={view_ms:.1f}",
+                f"total;dur={total_ms:.1f}",
+            )
+        )
+
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "total_ms": round(total_ms, 1),
+            "view_ms": round(view_ms, 1),
+            "db_ms": round(profile.db_ms, 1),
+            "queries": profile.queries,
+            "template_ms": round(profile.template_ms, 1),
+        }
+        if total_ms >= self.slow_request_ms:
+            record["top_queries"] = [
+                {"ms": round(duration_ms, 1), "sql": sql[:MAX_SQL_LENGTH]}
+                for duration_ms, _, sql in sorted(profile.top_queries, reverse=True)
+            ]
+            logger.warning(json.dumps(record, ensure_ascii=False))
+        elif random.random() < self.sample_rate:
+            logger.info(json.dumps(record, ensure_ascii=False))
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        start_view()
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        start_view()
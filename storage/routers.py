@@ -0,0 +1,136 @@
+"""
+Чтение с реплик базы данных.
+
+Реплики (DATABASE_REPLICAS) используются только для чтения внутри
+веб-запросов: ReplicaRoutingMiddleware разрешает их на время запроса.
+Задачи Celery, команды и все остальное работают с основной БД.
+
+После первой записи в запросе все его чтения идут в основную БД, а в
+ответ ставится cookie, по которой следующие запросы пользователя в течение
+DATABASE_REPLICA_MAX_LAG секунд тоже читают из основной БД. Так пользователь
+сразу видит свою аренду или регистрацию, даже если реплика отстает.
+"""
+
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PRIMARY_COOKIE = "use_primary_until"
+
+
+class RequestRouting:
+    """
+    Состояние маршрутизации запросов к БД в рамках одного веб-запроса
+    """
+
+    def __init__(self, use_replica):
+        self.use_replica = use_replica
+        self.wrote = False
+
+
+current_routing = ContextVar("current_routing", default=None)
+
+
+@contextmanager
+def use_primary():
+    """
+    Чтения внутри блока идут в основную БД
+    """
+    routing = current_routing.get()
+    if routing is None or not routing.use_replica:
+        yield
+        return
+    routing.use_replica = False
+    try:
+        yield
+    finally:
+        routing.use_replica = not routing.wrote
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = current_routing.get()
+        if (
+            routing is None
+            or not routing.use_replica
+            or not settings.DATABASE_REPLICAS
+            # Внутри транзакции читаем то же, что пишем
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        routing = current_routing.get()
+        if routing is not None:
+            routing.use_replica = False
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # На репликах те же данные, что и в основной БД
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Разрешает чтение с реплик на время запроса, если пользователь
+    недавно ничего не записывал
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        routing = self.get_routing(request)
+        token = current_routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        return self.finish(response, routing)
+
+    async def __acall__(self, request):
+        # Синхронный ORM в sync_to_async получает копию контекста
+        # с тем же объектом RequestRouting
+        routing = self.get_routing(request)
+        token = current_routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        return self.finish(response, routing)
+
+    def get_routing(self, request) -> RequestRouting:
+        try:
+            primary_until = float(request.COOKIES.get(PRIMARY_COOKIE, 0))
+        except ValueError:
+            primary_until = 0
+        return RequestRouting(use_replica=primary_until < time.time())
+
+    def finish(self, response, routing):
+        if routing.wrote and settings.DATABASE_REPLICAS:
+            max_lag = settings.DATABASE_REPLICA_MAX_LAG
+            response.set_cookie(
+                PRIMARY_COOKIE,
+                str(round(time.time() + max_lag)),
+                max_age=max_lag,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
@@ -0,0 +1,22 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_storage_version_on_commit, bump_user_version_on_commit
+from .models import Storage, Box, Rent
+
+
+@receiver([post_save, post_delete], sender=Storage)
+def invalidate_storage(sender, instance, **kwargs):
+    bump_storage_version_on_commit(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Box)
+def invalidate_box(sender, instance, **kwargs):
+    bump_storage_version_on_commit(instance.storage_id)
+
+
+@receiver([post_save, post_delete], sender=Rent)
+def invalidate_rent(sender, instance, **kwargs):
+    bump_storage_version_on_commit(instance.box.storage_id)
+    if instance.user_id:
+        bump_user_version_on_commit(instance.user_id)
@@ -0,0 +1,227 @@
+"""
+Статические файлы с хэшем в имени и заранее сжатыми копиями.
+
+collectstatic сохраняет файлы под именами с хэшем содержимого
+(ManifestStaticFilesStorage) и рядом записывает сжатые копии .gz и,
+если установлен пакет brotli, .br. StaticFilesMiddleware отдает их
+с заголовком Cache-Control immutable: имя файла меняется вместе
+с содержимым, поэтому браузеру не нужно перепроверять файл.
+"""
+
+import functools
+import gzip
+import mimetypes
+import os
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.staticfiles.storage import (
+    ManifestStaticFilesStorage,
+    staticfiles_storage,
+)
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Расширения файлов, которые имеет смысл сжимать
+COMPRESSIBLE_EXTENSIONS = (".css", ".js", ".svg", ".json", ".map", ".txt", ".xml")
+# Сжатая копия сохраняется, только если она меньше оригинала хотя бы на 5%
+MIN_COMPRESSION_RATIO = 0.95
+# Сжатые копии в порядке предпочтения: кодировка и расширение файла
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+
+def compress(content, encoding) -> bytes:
+    if encoding == "br":
+        return brotli.compress(content, quality=11)
+    return gzip.compress(content, compresslevel=9, mtime=0)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Хранилище статики, которое после добавления хэшей в имена файлов
+    записывает рядом сжатые копии
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        hashed_names = set()
+        for name, hashed_name, processed in super().post_process(
+            paths, dry_run, **options
+        ):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed_names.add(hashed_name)
+            yield name, hashed_name, processed
+
+        if dry_run:
+            return
+        for hashed_name in sorted(hashed_names):
+            self.compress_file(hashed_name)
+
+    def compress_file(self, name):
+        if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+            return
+        path = self.path(name)
+        with open(path, "rb") as file:
+            content = file.read()
+
+        for encoding, extension in ENCODINGS:
+            if encoding == "br" and brotli is None:
+                continue
+            compressed = compress(content, encoding)
+            if len(compressed) < len(content) * MIN_COMPRESSION_RATIO:
+                with open(path + extension, "wb") as file:
+                    file.write(compressed)
+
+
+@functools.cache
+def get_static_files() -> dict:
+    """
+    Файлы STATIC_ROOT: путь относительно STATIC_ROOT -> кодировки сжатых копий
+    и признак хэша содержимого в имени.
+
+    Статика меняется только при развертывании вместе с перезапуском процесса,
+    поэтому список строится один раз
+    """
+    names = set()
+    for directory, _, file_names in os.walk(settings.STATIC_ROOT):
+        for file_name in file_names:
+            path = os.path.relpath(
+                os.path.join(directory, file_name), settings.STATIC_ROOT
+            )
+            names.add(path.replace(os.sep, "/"))
+    hashed_names = set(getattr(staticfiles_storage, "hashed_files", {}).values())
+
+    return {
+        name: (
+            {
+                encoding
+                for encoding, extension in ENCODINGS
+                if name + extension in names
+            },
+            name in hashed_names,
+        )
+        for name in names
+    }
+
+
+@functools.lru_cache(maxsize=128)
+def parse_accept_encoding(accept_encoding: str) -> dict:
+    """
+    Кодировки из заголовка Accept-Encoding и их веса q.
+    Заголовков у браузеров немного, поэтому разбор кэшируется
+    """
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, *params = (part.strip() for part in item.split(";"))
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    return qualities
+
+
+def choose_encoding(encodings, accept_encoding: str):
+    """
+    Кодировка и расширение сжатой копии из encodings с наибольшим весом
+    в Accept-Encoding. При равных весах выбирается первая в ENCODINGS.
+    Кодировки с q=0 клиент не принимает, * задает вес остальных кодировок
+    """
+    qualities = parse_accept_encoding(accept_encoding)
+    chosen, chosen_quality = None, 0
+    for encoding, extension in ENCODINGS:
+        if encoding not in encodings:
+            continue
+        quality = qualities.get(encoding, qualities.get("*", 0))
+        if quality > chosen_quality:
+            chosen, chosen_quality = (encoding, extension), quality
+    return chosen
+
+
+class StaticFilesMiddleware:
+    """
+    Отдает файлы из STATIC_ROOT, выбирая сжатую копию по Accept-Encoding.
+
+    Файлы с хэшем в имени кэшируются браузером бессрочно, остальные
+    перепроверяются по Last-Modified
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.serve_static(request)
+        if response is not None:
+            return response
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        # Список файлов собран заранее, файл открывается без чтения,
+        # поэтому отдача не блокирует цикл событий надолго
+        response = self.serve_static(request)
+        if response is not None:
+            return response
+        return await self.get_response(request)
+
+    def serve_static(self, request):
+        if request.method in ("GET", "HEAD") and request.path.startswith(self.prefix):
+            return self.serve(request, request.path[len(self.prefix) :])
+        return None
+
+    def serve(self, request, name):
+        static_file = get_static_files().get(name)
+        if static_file is None:
+            return None
+        encodings, hashed = static_file
+
+        path = os.path.join(settings.STATIC_ROOT, name)
+        content_type, _ = mimetypes.guess_type(name)
+        content_encoding = None
+        chosen = choose_encoding(encodings, request.headers.get("Accept-Encoding", ""))
+        if chosen:
+            content_encoding, extension = chosen
+            path += extension
+
+        stat = os.stat(path)
+        if not hashed and not was_modified_since(
+            request.headers.get("If-Modified-Since"), stat.st_mtime
+        ):
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(
+                open(path, "rb"),
+                filename=os.path.basename(name),
+                content_type=content_type or "application/octet-stream",
+            )
+            if content_encoding:
+                response.headers["Content-Encoding"] = content_encoding
+
+        response.headers["Last-Modified"] = http_date(stat.st_mtime)
+        response.headers["Cache-Control"] = (
+            IMMUTABLE_CACHE_CONTROL if hashed else REVALIDATE_CACHE_CONTROL
+        )
+        if encodings:
+            response.headers["Vary"] = "Accept-Encoding"
+        return response
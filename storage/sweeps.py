@@ -0,0 +1,164 @@
+"""
+Периодический обход аренд: напоминания об окончании срока, перевод
+в статус 'просрочено' и напоминания о просроченных арендах.
+
+Аренды выбираются запросами по диапазону end_date (индекс по status и
+end_date) и обрабатываются пачками: каждая пачка блокируется при выборке,
+помечается одним UPDATE, а письма записываются в очередь писем в той же
+транзакции.
+"""
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils.timezone import now
+
+import storage.messages as msg
+from storage import cache as catalog_cache, task_metrics
+from .models import Box, Rent, OutboxEmail
+
+# За сколько дней до окончания аренды отправляется напоминание
+REMINDER_DAYS = {30: "месяц", 14: "2 недели", 7: "неделю", 3: "3 дня"}
+# Как часто повторяется напоминание о просроченной аренде
+OVERDUE_REMINDER_INTERVAL = timedelta(days=30)
+# Статусы аренд, которые переводятся в 'просрочено' в конце срока
+EXPIRING_STATUSES = ("created", "active")
+BATCH_SIZE = 500
+
+
+def lock_batch(rents, batch_size) -> list:
+    """
+    Выбирает пачку аренд и блокирует их строки до конца транзакции,
+    в которой пачка помечается и письма записываются в очередь.
+
+    Строки, заблокированные другим обходом, пропускаются (SKIP LOCKED),
+    а после фиксации его транзакции уже не подходят под фильтр, поэтому
+    два параллельных обхода не отправляют одно напоминание дважды
+    """
+    return list(rents.select_for_update(skip_locked=True, of=("self",))[:batch_size])
+
+
+def send_rent_reminders(batch_size=BATCH_SIZE) -> int:
+    """
+    Отправляет напоминания об окончании аренды.
+
+    Для каждого порога выбираются аренды, которые заканчиваются после
+    предыдущего (меньшего) порога, но не позже текущего. Напоминание
+    не отправляется, если аренда была создана уже после наступления порога.
+    """
+    current_time = now()
+    sent = 0
+    window_start = current_time
+    for days, time_insert in sorted(REMINDER_DAYS.items()):
+        window_end = current_time + timedelta(days=days)
+        rents = (
+            Rent.objects.filter(
+                status__in=EXPIRING_STATUSES,
+                end_date__gt=window_start,
+                end_date__lte=window_end,
+                created_at__lte=F("end_date") - timedelta(days=days),
+            )
+            .filter(Q(reminder_days_sent__isnull=True) | Q(reminder_days_sent__gt=days))
+            .select_related("box__storage")
+            .order_by("end_date")
+        )
+        while True:
+            with transaction.atomic():
+                batch = lock_batch(rents, batch_size)
+                if not batch:
+                    break
+                Rent.objects.filter(pk__in=[rent.pk for rent in batch]).update(
+                    reminder_days_sent=days
+                )
+                OutboxEmail.objects.queue(
+                    (*msg.create_notif_end_rent_message(rent, time_insert), rent.email)
+                    for rent in batch
+                )
+            # Напоминание положено отправить за days дней до окончания аренды
+            sent_at = now()
+            task_metrics.observe_sweep_lateness(
+                "reminder",
+                [sent_at - (rent.end_date - timedelta(days=days)) for rent in batch],
+            )
+            sent += len(batch)
+        window_start = window_end
+
+    return sent
+
+
+def expire_rents(batch_size=BATCH_SIZE) -> int:
+    """
+    Переводит в статус 'просрочено' аренды, срок которых истек
+    """
+    current_time = now()
+    expired = 0
+    rents = Rent.objects.filter(
+        status__in=EXPIRING_STATUSES, end_date__lte=current_time
+    ).order_by("end_date")
+    fields = ("pk", "box_id", "box__storage_id", "user_id", "end_date")
+    while batch := list(rents.values_list(*fields)[:batch_size]):
+        with transaction.atomic():
+            expired += Rent.objects.filter(
+                pk__in=[pk for pk, *_ in batch], status__in=EXPIRING_STATUSES
+            ).update(status="expired", updated_at=current_time)
+            # Просроченная аренда больше не активна: бокс занят,
+            # только если у него есть другая активная аренда
+            Box.objects.filter(
+                pk__in={box_id for _, box_id, *_ in batch}
+            ).update_occupancy()
+            # Просрочка меняет число активных аренд в сводке складов
+            # и статус аренды в личном кабинете
+            for storage_id in {storage_id for _, _, storage_id, *_ in batch}:
+                catalog_cache.bump_storage_version_on_commit(storage_id)
+            for user_id in {user_id for _, _, _, user_id, _ in batch if user_id}:
+                catalog_cache.bump_user_version_on_commit(user_id)
+        expired_at = now()
+        task_metrics.observe_sweep_lateness(
+            "expire", [expired_at - end_date for *_, end_date in batch]
+        )
+
+    return expired
+
+
+def send_overdue_reminders(batch_size=BATCH_SIZE) -> int:
+    """
+    Отправляет напоминания о просроченных арендах раз в OVERDUE_REMINDER_INTERVAL
+    """
+    current_time = now()
+    sent = 0
+    rents = (
+        Rent.objects.filter(status="expired")
+        .filter(
+            Q(overdue_reminded_at__isnull=True)
+            | Q(overdue_reminded_at__lte=current_time - OVERDUE_REMINDER_INTERVAL)
+        )
+        .select_related("box__storage")
+        .order_by("end_date")
+    )
+    while True:
+        with transaction.atomic():
+            batch = lock_batch(rents, batch_size)
+            if not batch:
+                break
+            Rent.objects.filter(pk__in=[rent.pk for rent in batch]).update(
+                overdue_reminded_at=current_time
+            )
+            OutboxEmail.objects.queue(
+                (*msg.create_reminder_for_overdue_rent_message(rent), rent.email)
+                for rent in batch
+            )
+        sent += len(batch)
+
+    return sent
+
+
+def sweep_rents(batch_size=BATCH_SIZE) -> dict:
+    """
+    Выполняет все шаги обхода аренд и возвращает число обработанных аренд
+    """
+    return {
+        "reminders": send_rent_reminders(batch_size),
+        "expired": expire_rents(batch_size),
+        "overdue_reminders": send_overdue_reminders(batch_size),
+    }
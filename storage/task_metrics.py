@@ -0,0 +1,425 @@
+"""
+Метрики задач Celery и очередей брокера.
+
+Обработчики сигналов Celery записывают для каждой задачи число запусков
+по результату, время выполнения и опоздание: насколько позже
+запланированного времени (eta) или времени постановки в очередь задача
+начала выполняться. Счетчики хранятся в кэше (Redis), общем для всех
+воркеров и веб-процессов, значения времени раскладываются по корзинам
+гистограммы.
+
+Глубина очередей и число выданных воркерам, но не подтвержденных
+сообщений (среди них задачи с eta, которые ждут своего времени в воркере)
+читаются из Redis-брокера в момент запроса метрик.
+
+Для очереди писем и обхода аренд записываются гистограммы задержки
+отправки письма (sent_at - created_at) и опоздания обхода: насколько позже
+положенного времени (end_date минус срок напоминания или end_date при
+просрочке) аренда была обработана. Число неотправленных писем и возраст
+самого старого из них считаются по БД в момент запроса метрик.
+"""
+
+import math
+import time
+from collections import Counter
+from datetime import datetime
+
+import redis
+from celery.signals import (
+    before_task_publish,
+    task_postrun,
+    task_prerun,
+    task_revoked,
+)
+from django.core.cache import cache
+from django.db.models import Count, Min
+from django.utils.timezone import now
+
+from sigvard import celery_app
+
+from . import db_pool
+from .models import OutboxEmail
+
+METRIC_KEY = "celery:metrics:{task}:{name}"
+# Верхние границы корзин гистограмм, в секундах
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 30, 60, 300, math.inf)
+LATENESS_BUCKETS = (1, 10, 60, 300, 1800, 3600, 6 * 3600, math.inf)
+HISTOGRAMS = {"duration": DURATION_BUCKETS, "lateness": LATENESS_BUCKETS}
+# Гистограммы очереди писем и обхода аренд
+EVENT_METRIC_KEY = "metrics:{name}"
+EMAIL_DELAY_BUCKETS = (1, 10, 60, 300, 1800, 3600, 6 * 3600, math.inf)
+SWEEP_LATENESS_BUCKETS = (
+    60,
+    300,
+    900,
+    3600,
+    6 * 3600,
+    24 * 3600,
+    3 * 24 * 3600,
+    math.inf,
+)
+# Шаги обхода аренд, для которых записывается опоздание
+SWEEP_STEPS = ("reminder", "expire")
+EVENT_HISTOGRAMS = {
+    "outbox_delay": EMAIL_DELAY_BUCKETS,
+    **{f"sweep_lateness:{step}": SWEEP_LATENESS_BUCKETS for step in SWEEP_STEPS},
+}
+# Статусы писем, которые еще не отправлены
+UNSENT_STATUSES = ("pending", "sending", "failed")
+# Результаты задач из сигнала task_postrun
+STATES = {"SUCCESS": "succeeded", "FAILURE": "failed", "RETRY": "retried"}
+# Очередь сообщений с подтверждением у брокера Redis
+UNACKED_KEY = "unacked"
+# Сколько секунд ждать ответа брокера при запросе метрик
+BROKER_TIMEOUT = 1
+
+# Время начала выполняемых задач текущего процесса по id задачи
+started_tasks = {}
+
+
+def increment(key, delta=1):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        if not cache.add(key, delta, timeout=None):
+            cache.incr(key, delta)
+
+
+def get_bucket(value, buckets):
+    return next(bucket for bucket in buckets if value <= bucket)
+
+
+def observe_many(key, values, buckets):
+    """
+    Добавляет значения values (в секундах) в гистограмму с ключами
+    {key}:bucket:<корзина> и {key}:sum_ms. Каждая корзина увеличивается
+    одним запросом к кэшу
+    """
+    counts = Counter(get_bucket(value, buckets) for value in values)
+    for bucket, count in counts.items():
+        increment(f"{key}:bucket:{bucket}", count)
+    if counts:
+        # В кэше хранятся целые числа, поэтому сумма хранится в миллисекундах
+        increment(f"{key}:sum_ms", round(sum(values) * 1000))
+
+
+def observe(task_name, metric, value, buckets):
+    """
+    Добавляет значение value в гистограмму metric задачи
+    """
+    observe_many(METRIC_KEY.format(task=task_name, name=metric), [value], buckets)
+
+
+def observe_email_delays(outbox_emails):
+    """
+    Записывает задержку отправки писем: от записи в очередь до отправки
+    """
+    observe_many(
+        EVENT_METRIC_KEY.format(name="outbox_delay"),
+        [
+            (outbox_email.sent_at - outbox_email.created_at).total_seconds()
+            for outbox_email in outbox_emails
+        ],
+        EMAIL_DELAY_BUCKETS,
+    )
+
+
+def observe_sweep_lateness(step, delays):
+    """
+    Записывает опоздание шага step обхода аренд: delays - насколько позже
+    положенного времени были обработаны аренды (timedelta)
+    """
+    observe_many(
+        EVENT_METRIC_KEY.format(name=f"sweep_lateness:{step}"),
+        [max(delay.total_seconds(), 0) for delay in delays],
+        SWEEP_LATENESS_BUCKETS,
+    )
+
+
+def parse_eta(eta):
+    if not eta:
+        return None
+    if isinstance(eta, str):
+        eta = datetime.fromisoformat(eta)
+    return eta.timestamp()
+
+
+@before_task_publish.connect
+def mark_published(sender=None, headers=None, **kwargs):
+    if headers is None:
+        return
+    headers["published_at"] = time.time()
+    if headers.get("eta"):
+        increment(METRIC_KEY.format(task=sender, name="eta_pending"))
+
+
+@task_prerun.connect
+def start_task(sender=None, task_id=None, task=None, **kwargs):
+    started_tasks[task_id] = time.perf_counter()
+    request = task.request
+    eta = parse_eta(request.eta)
+    if eta is not None:
+        increment(METRIC_KEY.format(task=task.name, name="eta_pending"), -1)
+    scheduled_at = eta or getattr(request, "published_at", None)
+    if scheduled_at is not None:
+        observe(
+            task.name,
+            "lateness",
+            max(time.time() - scheduled_at, 0),
+            LATENESS_BUCKETS,
+        )
+
+
+@task_postrun.connect
+def finish_task(sender=None, task_id=None, task=None, state=None, **kwargs):
+    started = started_tasks.pop(task_id, None)
+    if started is not None:
+        observe(task.name, "duration", time.perf_counter() - started, DURATION_BUCKETS)
+    increment(METRIC_KEY.format(task=task.name, name=STATES.get(state, "other")))
+
+
+@task_postrun.connect
+def publish_pool_stats(sender=None, **kwargs):
+    db_pool.publish_pool_stats()
+
+
+@task_revoked.connect
+def revoke_task(sender=None, request=None, **kwargs):
+    if sender is not None and request is not None and request.eta:
+        increment(METRIC_KEY.format(task=sender.name, name="eta_pending"), -1)
+
+
+def get_task_names() -> list:
+    # Веб-процесс мог еще не импортировать модули задач
+    celery_app.autodiscover_tasks(force=True)
+    return sorted(name for name in celery_app.tasks if not name.startswith("celery."))
+
+
+def get_task_stats() -> dict:
+    """
+    Накопленные метрики задач: {задача: {метрика: значение}}
+    """
+    task_names = get_task_names()
+    names = ["eta_pending", *STATES.values(), "other"]
+    for metric, buckets in HISTOGRAMS.items():
+        names += [f"{metric}:bucket:{bucket}" for bucket in buckets]
+        names.append(f"{metric}:sum_ms")
+    keys = {
+        METRIC_KEY.format(task=task_name, name=name): (task_name, name)
+        for task_name in task_names
+        for name in names
+    }
+    values = cache.get_many(list(keys))
+
+    stats = {task_name: dict.fromkeys(names, 0) for task_name in task_names}
+    for key, value in values.items():
+        task_name, name = keys[key]
+        stats[task_name][name] = value
+    return stats
+
+
+def get_event_stats() -> dict:
+    """
+    Накопленные гистограммы очереди писем и обхода аренд:
+    {гистограмма: {метрика: значение}}
+    """
+    names = {
+        histogram: [*(f"bucket:{bucket}" for bucket in buckets), "sum_ms"]
+        for histogram, buckets in EVENT_HISTOGRAMS.items()
+    }
+    keys = {
+        EVENT_METRIC_KEY.format(name=f"{histogram}:{name}"): (histogram, name)
+        for histogram, histogram_names in names.items()
+        for name in histogram_names
+    }
+    values = cache.get_many(list(keys))
+
+    stats = {
+        histogram: dict.fromkeys(histogram_names, 0)
+        for histogram, histogram_names in names.items()
+    }
+    for key, value in values.items():
+        histogram, name = keys[key]
+        stats[histogram][name] = value
+    return stats
+
+
+def get_outbox_stats() -> dict:
+    """
+    Неотправленные письма: {статус: {"count": число,
+    "oldest_age": возраст самого старого письма в секундах}}
+    """
+    rows = (
+        OutboxEmail.objects.filter(status__in=UNSENT_STATUSES)
+        .values("status")
+        .annotate(count=Count("pk"), oldest=Min("created_at"))
+        .order_by()
+    )
+    current_time = now()
+    stats = {status: {"count": 0, "oldest_age": 0} for status in UNSENT_STATUSES}
+    for row in rows:
+        stats[row["status"]] = {
+            "count": row["count"],
+            "oldest_age": (current_time - row["oldest"]).total_seconds(),
+        }
+    return stats
+
+
+def get_broker_stats() -> dict | None:
+    """
+    Длина очередей и число неподтвержденных сообщений брокера Redis.
+    None, если брокер не Redis или недоступен
+    """
+    broker_url = celery_app.conf.broker_url or ""
+    if not broker_url.startswith(("redis://", "rediss://")):
+        return None
+    queues = sorted(
+        {celery_app.conf.task_default_queue}
+        | {queue.name for queue in celery_app.conf.task_queues or ()}
+    )
+    try:
+        client = redis.Redis.from_url(
+            broker_url,
+            socket_timeout=BROKER_TIMEOUT,
+            socket_connect_timeout=BROKER_TIMEOUT,
+        )
+        with client.pipeline() as pipeline:
+            for queue in queues:
+                pipeline.llen(queue)
+            pipeline.hlen(UNACKED_KEY)
+            *lengths, unacked = pipeline.execute()
+    except redis.RedisError:
+        return None
+    return {"queues": dict(zip(queues, lengths)), "unacked": unacked}
+
+
+def get_count(stats, metric) -> int:
+    """
+    Число значений в гистограмме metric задачи
+    """
+    return sum(stats[f"{metric}:bucket:{bucket}"] for bucket in HISTOGRAMS[metric])
+
+
+def format_bucket(bucket) -> str:
+    return "+Inf" if bucket == math.inf else str(bucket)
+
+
+def render_histogram(name, labels, stats, buckets, prefix="") -> list:
+    """
+    Строки гистограммы name с метками labels в формате Prometheus.
+    stats содержит значения {prefix}bucket:<корзина> и {prefix}sum_ms
+    """
+    lines = []
+    count = 0
+    for bucket in buckets:
+        count += stats[f"{prefix}bucket:{bucket}"]
+        bucket_labels = ",".join([*labels, f'le="{format_bucket(bucket)}"'])
+        lines.append(f"{name}_bucket{{{bucket_labels}}} {count}")
+    series = f"{{{','.join(labels)}}}" if labels else ""
+    lines.append(f"{name}_sum{series} {stats[f'{prefix}sum_ms'] / 1000}")
+    lines.append(f"{name}_count{series} {count}")
+    return lines
+
+
+def render_prometheus(task_stats, broker_stats) -> str:
+    """
+    Метрики в текстовом формате Prometheus
+    """
+    lines = [
+        "# HELP celery_task_runs_total Завершенные запуски задач по результату",
+        "# TYPE celery_task_runs_total counter",
+    ]
+    for task_name, stats in task_stats.items():
+        for state in (*STATES.values(), "other"):
+            lines.append(
+                f'celery_task_runs_total{{task="{task_name}",state="{state}"}} '
+                f"{stats[state]}"
+            )
+
+    for metric, buckets, description in (
+        ("duration", DURATION_BUCKETS, "Время выполнения задач"),
+        (
+            "lateness",
+            LATENESS_BUCKETS,
+            "Опоздание начала задач относительно eta или постановки в очередь",
+        ),
+    ):
+        name = f"celery_task_{metric}_seconds"
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+        for task_name, stats in task_stats.items():
+            lines += render_histogram(
+                name, [f'task="{task_name}"'], stats, buckets, prefix=f"{metric}:"
+            )
+
+    lines += [
+        "# HELP celery_eta_tasks_pending Поставленные задачи с eta, еще не начатые",
+        "# TYPE celery_eta_tasks_pending gauge",
+    ]
+    for task_name, stats in task_stats.items():
+        lines.append(
+            f'celery_eta_tasks_pending{{task="{task_name}"}} {stats["eta_pending"]}'
+        )
+
+    lines += [
+        "# HELP celery_broker_up Доступен ли брокер",
+        "# TYPE celery_broker_up gauge",
+        f"celery_broker_up {int(broker_stats is not None)}",
+    ]
+    if broker_stats is not None:
+        lines += [
+            "# HELP celery_queue_length Сообщения в очереди брокера",
+            "# TYPE celery_queue_length gauge",
+        ]
+        for queue, length in broker_stats["queues"].items():
+            lines.append(f'celery_queue_length{{queue="{queue}"}} {length}')
+        lines += [
+            "# HELP celery_unacked_messages Сообщения, выданные воркерам и еще "
+            "не подтвержденные",
+            "# TYPE celery_unacked_messages gauge",
+            f"celery_unacked_messages {broker_stats['unacked']}",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def render_outbox_prometheus(outbox_stats, event_stats) -> str:
+    """
+    Метрики очереди писем и обхода аренд в текстовом формате Prometheus
+    """
+    lines = [
+        "# HELP outbox_emails Неотправленные письма по статусу",
+        "# TYPE outbox_emails gauge",
+    ]
+    for status, stats in outbox_stats.items():
+        lines.append(f'outbox_emails{{status="{status}"}} {stats["count"]}')
+    lines += [
+        "# HELP outbox_oldest_email_age_seconds Возраст самого старого "
+        "неотправленного письма по статусу",
+        "# TYPE outbox_oldest_email_age_seconds gauge",
+    ]
+    for status, stats in outbox_stats.items():
+        lines.append(
+            f'outbox_oldest_email_age_seconds{{status="{status}"}} '
+            f'{stats["oldest_age"]}'
+        )
+
+    name = "outbox_email_delay_seconds"
+    lines += [
+        f"# HELP {name} Время от записи письма в очередь до отправки",
+        f"# TYPE {name} histogram",
+        *render_histogram(name, [], event_stats["outbox_delay"], EMAIL_DELAY_BUCKETS),
+    ]
+
+    name = "rent_sweep_lateness_seconds"
+    lines += [
+        f"# HELP {name} Опоздание обхода аренд относительно end_date минус срок "
+        "напоминания (reminder) или end_date (expire)",
+        f"# TYPE {name} histogram",
+    ]
+    for step in SWEEP_STEPS:
+        lines += render_histogram(
+            name,
+            [f'step="{step}"'],
+            event_stats[f"sweep_lateness:{step}"],
+            SWEEP_LATENESS_BUCKETS,
+        )
+    return "\n".join(lines) + "\n"
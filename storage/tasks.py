@@ -1,9 +1,41 @@
-from datetime import datetime, timedelta
+import re
 
 from celery import shared_task
 from django.apps import apps
 
-from .emails import send_email_message
+# Модуль загружается воркером при поиске задач, а веб-процессом при отправке
+# первой задачи. Вместе с ним загружаются приложение Celery с настройками
+# проекта и обработчики сигналов, которые записывают метрики задач
+from . import task_metrics  # noqa: F401
+from .emails import OUTBOX_BATCH_SIZE, send_outbox_batch
+from .thumbnails import generate_photo_derivatives
+
+# Напоминания об окончании аренды, запланированные до перехода
+# на sweep_rents_task (см. messages.create_notif_end_rent_message)
+LEGACY_REMINDER_SUBJECT_RE = re.compile(r"^Напоминание: окончание аренды №(\d+) бокса$")
+LEGACY_REMINDER_END_DATE_RE = re.compile(r" (\d{4}-\d{2}-\d{2})\.\n")
+
+
+def is_legacy_reminder_outdated(subject, message) -> bool:
+    """
+    Напоминание об окончании аренды, запланированное до перехода
+    на sweep_rents_task, больше не нужно: аренду удалили, завершили
+    или отменили, либо изменили дату ее окончания.
+
+    Эти задачи уже нельзя отозвать: их id удалены миграцией 0010
+    """
+    from .sweeps import EXPIRING_STATUSES
+
+    match = LEGACY_REMINDER_SUBJECT_RE.match(subject)
+    if match is None:
+        # Письмо без отложенной отправки, например подтверждение аренды
+        return False
+    Rent = apps.get_model("storage", "Rent")
+    rent = Rent.objects.filter(pk=match[1]).first()
+    if rent is None or rent.status not in EXPIRING_STATUSES:
+        return True
+    end_date = LEGACY_REMINDER_END_DATE_RE.search(message)
+    return end_date is None or end_date[1] != rent.end_date.date().isoformat()
 
 
 @shared_task
@@ -11,38 +43,80 @@ def send_email_message_task(subject, message, user_email):
     """
     Асинхронная задача для отправки email-сообщения.
 
-    Эта функция используется для выполнения отправки email в фоновом режиме,
-    чтобы избежать задержек в основном потоке приложения.
+    Письмо записывается в очередь писем и отправляется send_outbox_emails_task
+    вместе с остальными письмами через одно SMTP-соединение.
+    Устаревшие напоминания, запланированные до sweep_rents_task, пропускаются.
     """
-    return send_email_message(subject, message, user_email)
+    if is_legacy_reminder_outdated(subject, message):
+        return
+    OutboxEmail = apps.get_model("storage", "OutboxEmail")
+    OutboxEmail.objects.queue([(subject, message, user_email)])
+
+
+@shared_task
+def send_outbox_emails_task(batch_size=OUTBOX_BATCH_SIZE):
+    """
+    Отправляет письма из очереди пачками, пока в ней есть письма,
+    которые пора отправить
+    """
+    processed = 0
+    while batch_processed := send_outbox_batch(batch_size):
+        processed += batch_processed
+    return processed
 
 
 @shared_task
 def send_monthly_email_reminder(rent_id, subject, message):
     """
-    Задача для отправки писем с напоминаниями раз в месяц.
+    Задача для отправки писем с напоминаниями о просроченной аренде.
+
+    Оставлена для задач, поставленных в очередь до перехода на sweep_rents_task:
+    отправляет письмо один раз и больше не планирует себя повторно.
+    Письмо не отправляется, если аренду уже закрыли.
     """
     Rent = apps.get_model("storage", "Rent")
+    OutboxEmail = apps.get_model("storage", "OutboxEmail")
     rent = Rent.objects.get(pk=rent_id)
+    if rent.status != "expired":
+        return
 
-    next_run_time = datetime.now() + timedelta(days=30)
-    task = send_monthly_email_reminder.apply_async(
-        (rent_id, subject, message), eta=next_run_time
-    )
-
-    rent.task_ids.append(task.id)
-    rent.save()
-
-    return send_email_message(subject, message, rent.email)
+    OutboxEmail.objects.queue([(subject, message, rent.email)])
 
 
 @shared_task
 def set_rent_status_to_expired_task(rent_id):
     """
-    Задача для изменения статуса на просрочено в конце срока аренды
+    Задача для изменения статуса на просрочено в конце срока аренды.
+
+    Новые аренды переводит в статус 'просрочено' sweep_rents_task,
+    задача обрабатывает ранее запланированные аренды.
     """
     Rent = apps.get_model("storage", "Rent")
-    rent = Rent.objects.get(pk=rent_id)
+    rent = Rent.objects.select_related("box__storage").get(pk=rent_id)
+
+    # Аренду могли завершить или отменить до конца срока
+    if rent.can_transition_to("expired"):
+        rent.expire()
+
+
+@shared_task
+def sweep_rents_task():
+    """
+    Периодическая задача: напоминания об окончании аренды, перевод
+    в статус 'просрочено' и напоминания о просроченных арендах
+    """
+    from .sweeps import sweep_rents
+
+    return sweep_rents()
+
 
-    rent.status = "expired"
-    rent.save()
+@shared_task
+def generate_photo_derivatives_task(storage_id):
+    """
+    Создает уменьшенные копии фотографии склада после ее загрузки
+    """
+    Storage = apps.get_model("storage", "Storage")
+    storage = Storage.objects.filter(pk=storage_id).first()
+    if storage is None or not storage.photo:
+        return []
+    return generate_photo_derivatives(storage)
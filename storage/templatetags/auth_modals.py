@@ -0,0 +1,51 @@
+import hashlib
+
+from django import template
+from django.template.loader import get_template, render_to_string
+from django.utils.functional import SimpleLazyObject
+
+from storage.prerender import CSRF_TOKEN_PLACEHOLDER, insert_csrf_token, prerender
+
+register = template.Library()
+
+AUTH_MODALS_TEMPLATE = "includes/auth_modals.html"
+
+
+def has_default_forms(context) -> bool:
+    """
+    Формы в контексте — ленивые пустые формы из storage.context_processors,
+    а не формы представления (например, с ошибками после отправки)
+    """
+    return all(
+        type(context.get(name)) is SimpleLazyObject
+        for name in ("register_form", "login_form")
+    )
+
+
+@register.simple_tag(takes_context=True)
+def auth_modals(context):
+    """
+    Модальные окна регистрации, входа и восстановления пароля.
+
+    Окна с пустыми формами рендерятся один раз на процесс, а CSRF-токен
+    подставляется в готовую разметку на каждый запрос
+    """
+    request = context.get("request")
+    if request is None or not has_default_forms(context):
+        return render_to_string(AUTH_MODALS_TEMPLATE, context.flatten(), request)
+
+    # Внутри предварительно отрендеренной страницы заглушка остается на месте,
+    # токен подставит код, который рендерил страницу
+    if str(context.get("csrf_token")) == CSRF_TOKEN_PLACEHOLDER:
+        return render_to_string(AUTH_MODALS_TEMPLATE, context.flatten())
+
+    source = get_template(AUTH_MODALS_TEMPLATE).template.source
+    html = prerender(
+        f"auth_modals:{hashlib.md5(source.encode(), usedforsecurity=False).hexdigest()}",
+        AUTH_MODALS_TEMPLATE,
+        {
+            "register_form": context["register_form"],
+            "login_form": context["login_form"],
+        },
+    )
+    return insert_csrf_token(html, request)
@@ -0,0 +1,40 @@
+from django import template
+from django.utils.html import format_html
+
+from storage.thumbnails import get_derivative_name
+
+register = template.Library()
+
+
+def get_srcset(photo, widths, image_format) -> str:
+    return ", ".join(
+        f"{photo.storage.url(get_derivative_name(photo.name, width, image_format))} {width}w"
+        for width in widths
+    )
+
+
+@register.simple_tag
+def storage_photo(storage, sizes="100vw", alt="", css_class=""):
+    """
+    Фотография склада с srcset из уменьшенных копий в WebP и JPEG.
+
+    Пока копии не созданы, выводится оригинал
+    """
+    photo = storage.photo
+    widths = storage.photo_widths
+    if not widths:
+        return format_html(
+            '<img src="{}" alt="{}" class="{}">', photo.url, alt, css_class
+        )
+
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}"></picture>',
+        get_srcset(photo, widths, "webp"),
+        sizes,
+        photo.storage.url(get_derivative_name(photo.name, widths[-1], "jpeg")),
+        get_srcset(photo, widths, "jpeg"),
+        sizes,
+        alt,
+        css_class,
+    )
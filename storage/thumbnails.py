@@ -0,0 +1,102 @@
+"""
+Уменьшенные копии фотографий складов.
+
+Для каждой ширины из PHOTO_WIDTHS рядом с оригиналом сохраняются копии
+в WebP и JPEG: storage_images/photo.png -> storage_images/photo-320w.webp и
+storage_images/photo-320w.jpg. Ширины, для которых копии уже есть,
+записываются в Storage.photo_widths, и шаблон строит srcset без обращений
+к файловому хранилищу (см. storage.templatetags.thumbnails).
+"""
+
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image
+
+from storage import cache as catalog_cache
+
+# Ширины уменьшенных копий в пикселях
+PHOTO_WIDTHS = (320, 640, 1024, 1600)
+# Расширение файла и параметры сохранения для каждого формата
+PHOTO_FORMATS = {
+    "webp": ("webp", {"format": "WEBP", "quality": 80, "method": 6}),
+    "jpeg": ("jpg", {"format": "JPEG", "quality": 82, "optimize": True}),
+}
+
+
+def get_derivative_name(name, width, image_format) -> str:
+    """
+    Имя файла уменьшенной копии фотографии name
+    """
+    extension, _ = PHOTO_FORMATS[image_format]
+    return f"{os.path.splitext(name)[0]}-{width}w.{extension}"
+
+
+def get_derivative_widths(original_width) -> list:
+    """
+    Ширины копий для оригинала шириной original_width.
+
+    Оригинал не увеличивается: копии шире оригинала не создаются,
+    но самая маленькая копия есть всегда
+    """
+    widths = [width for width in PHOTO_WIDTHS if width <= original_width]
+    return widths or [min(PHOTO_WIDTHS[0], original_width)]
+
+
+def to_rgb(image):
+    """
+    Изображение без прозрачности для JPEG: прозрачные области заливаются белым
+    """
+    if image.mode == "RGB":
+        return image
+    image = image.convert("RGBA")
+    background = Image.new("RGB", image.size, "white")
+    background.paste(image, mask=image.getchannel("A"))
+    return background
+
+
+def save_derivative(file_storage, name, image, image_format):
+    """
+    Сохраняет копию под именем name, заменяя прежнюю
+    """
+    _, save_options = PHOTO_FORMATS[image_format]
+    if image_format == "jpeg":
+        image = to_rgb(image)
+    buffer = BytesIO()
+    image.save(buffer, **save_options)
+    if file_storage.exists(name):
+        file_storage.delete(name)
+    file_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def generate_photo_derivatives(storage) -> list:
+    """
+    Создает уменьшенные копии фотографии склада и записывает их ширины
+    в Storage.photo_widths. Возвращает список ширин
+    """
+    Storage = type(storage)
+    name = storage.photo.name
+    file_storage = storage.photo.storage
+
+    with file_storage.open(name, "rb") as photo_file, Image.open(photo_file) as photo:
+        photo.load()
+        if photo.mode not in ("RGB", "RGBA"):
+            photo = photo.convert("RGBA")
+        widths = get_derivative_widths(photo.width)
+        for width in widths:
+            height = max(1, round(photo.height * width / photo.width))
+            resized = photo.resize((width, height), Image.Resampling.LANCZOS)
+            for image_format in PHOTO_FORMATS:
+                save_derivative(
+                    file_storage,
+                    get_derivative_name(name, width, image_format),
+                    resized,
+                    image_format,
+                )
+
+    # Фотографию могли заменить, пока создавались копии старой
+    if Storage.objects.filter(pk=storage.pk, photo=name).update(photo_widths=widths):
+        storage.photo_widths = widths
+        catalog_cache.bump_storage_version_on_commit(storage.pk)
+    return widths
@@ -12,5 +12,7 @@ urlpatterns = [
     path("login/", views.UserLoginView.as_view(), name="login"),
     path("logout/", views.UserLogoutView.as_view(), name="logout"),
     path("get_boxes/<int:storage_id>/", views.get_boxes, name="get_boxes"),
+    path("quote/<int:storage_id>/", views.get_quote, name="get_quote"),
     path("approval/", views.show_approval, name="approval"),
+    path("metrics/", views.celery_metrics, name="celery_metrics"),
 ]
@@ -1,18 +1,36 @@
-from collections import defaultdict
-from datetime import timedelta
+import hashlib
+import random
+from functools import wraps
+from urllib.parse import urlencode
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.auth.views import LoginView, LogoutView
 from django.contrib.messages.views import SuccessMessageMixin
-from django.db.models import Min, Max, Count, Q
+from django.core.exceptions import PermissionDenied
+from django.db import IntegrityError, transaction
+from django.db.models import Q
 from django.http import HttpRequest, HttpResponse, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse_lazy
-from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views.decorators.cache import cache_control, never_cache
 from django.views.generic import CreateView
 
-from .forms import UserRegisterForm, UserLoginForm, RentForm
+from . import cache as catalog_cache, db_pool
+from .forms import (
+    UserRegisterForm,
+    UserLoginForm,
+    RentForm,
+    BoxFilterForm,
+    QuoteForm,
+    RentHistoryForm,
+)
+from .context_processors import auth_forms
 from .models import Storage, Rent, Box
+from .prerender import insert_csrf_token, prerender
 
 
 class UserRegisterView(SuccessMessageMixin, CreateView):
@@ -80,89 +98,288 @@ class UserLogoutView(LogoutView):
     next_page = reverse_lazy("main_page")
 
 
-def main_page(request: HttpRequest) -> HttpResponse:
-    random_storage = Storage.objects.order_by("?").first()
-    storage_data = None
-    if random_storage:
-        storage_data = random_storage.boxes.aggregate(
-            total_boxes=Count("id"),
-            free_boxes=Count("id", filter=Q(is_occupied=False)),
-            min_price=Min("price"),
-            max_height=Max("height"),
-        )
-    context = {"storage": random_storage, "storage_data": storage_data}
-    return render(request, "index.html", context)
+async def abuild_storage_ids() -> list:
+    return [
+        pk async for pk in Storage.objects.order_by("id").values_list("pk", flat=True)
+    ]
 
 
-def boxes(request: HttpRequest) -> HttpResponse:
-    if request.method == "POST":
-        rent_form = RentForm(request.POST)
-        if rent_form.is_valid():
+async def abuild_catalog_storages() -> list:
+    """
+    Склады со сводкой по боксам и версиями складов в кэше каталога.
+
+    Версия запоминается вместе с данными: по ней кэшируются фрагменты
+    шаблона со складом. Версии читаются до запроса сводки, поэтому данные
+    не старше версии: если склад изменится между чтением версии и запросом,
+    фрагмент с прежней версией просто будет отрендерен заново. Склады,
+    созданные после чтения версий, в список не попадают: их создание
+    увеличивает версию каталога, и запись каталога будет пересчитана
+    """
+    storage_ids = await abuild_storage_ids()
+    versions = await catalog_cache.aget_versions(storage_ids)
+    storages = [
+        storage
+        async for storage in Storage.objects.with_box_stats()
+        .filter(pk__in=storage_ids)
+        .order_by("id")
+    ]
+    for storage in storages:
+        storage.cache_version = versions[storage.pk]
+    return storages
+
+
+async def aget_catalog_storages() -> list:
+    """
+    Склады каталога со сводкой по боксам, из кэша каталога
+    """
+    return await catalog_cache.aget_or_build("storages", abuild_catalog_storages)
+
+
+def get_storages_fragment_key(storages) -> str:
+    """
+    Ключ фрагментов шаблона со всеми складами: меняется при изменении
+    набора складов или версии любого из них
+    """
+    versions = ",".join(f"{storage.pk}:{storage.cache_version}" for storage in storages)
+    return hashlib.md5(versions.encode(), usedforsecurity=False).hexdigest()
+
+
+async def aget_storage_ids() -> list:
+    """
+    Id складов каталога, из кэша каталога
+    """
+    return await catalog_cache.aget_or_build("storage_ids", abuild_storage_ids)
+
+
+async def aget_storage(storage_id):
+    """
+    Склад со сводкой по боксам из кэша склада. None, если склад удален
+    """
+    return await catalog_cache.aget_or_build(
+        f"storage:{storage_id}",
+        Storage.objects.with_box_stats().filter(pk=storage_id).afirst,
+        storage_id=storage_id,
+    )
+
+
+async def main_page(request: HttpRequest) -> HttpResponse:
+    # Случайный склад выбирается из закэшированного списка id, а не через
+    # ORDER BY RANDOM(), который сортирует всю таблицу на каждый запрос.
+    # Из кэша читается только выбранный склад, а не весь каталог
+    storage_ids = await aget_storage_ids()
+    random_storage = (
+        await aget_storage(random.choice(storage_ids)) if storage_ids else None
+    )
+    context = {"storage": random_storage}
+    # Шаблоны Django синхронные (шапка читает request.user из сессии),
+    # поэтому рендеринг выполняется в потоке
+    return await sync_to_async(render)(request, "index.html", context)
+
+
+def save_rent_form(rent_form: RentForm) -> bool:
+    """
+    Проверяет и сохраняет форму аренды. False, если форма не сохранена
+    """
+    if not rent_form.is_valid():
+        return False
+    try:
+        with transaction.atomic():
             rent_form.save()
+    except IntegrityError:
+        # Бокс успели забронировать на эти даты параллельным запросом
+        rent_form.add_error("box", "Бокс занят на выбранные даты.")
+        return False
+    return True
 
+
+async def boxes(request: HttpRequest) -> HttpResponse:
+    if request.method == "POST":
+        rent_form = RentForm(request.POST)
+        # Транзакции работают только в синхронном коде
+        if await sync_to_async(save_rent_form)(rent_form):
             return redirect("success_rent")
     else:
         rent_form = RentForm()
 
-    storages = Storage.objects.all()
-    for storage in storages:
-        storage.total_boxes = storage.boxes.count()
-        storage.occupied_boxes = (
-            storage.boxes.filter(rents__status="active").distinct().count()
-        )
-        storage.available_boxes = storage.total_boxes - storage.occupied_boxes
-        storage.min_price = storage.boxes.aggregate(Min("price"))["price__min"]
-        storage.max_height = storage.boxes.aggregate(Max("height"))["height__max"]
+    storages = await aget_catalog_storages()
 
     context = {
         "storages": storages,
+        "storages_fragment_key": get_storages_fragment_key(storages),
         "rent_form": rent_form,
     }
-    return render(request, "boxes.html", context)
-
-
-def get_boxes(request: HttpRequest, storage_id: int) -> JsonResponse:
-    free_boxes = Box.objects.filter(storage_id=storage_id, is_occupied=False)
-    box_data = [
-        {
-            "id": box.id,
-            "number": box.number,
-            "area": box.area,
-            "price": box.price,
-            "level": box.level,
-            "length": box.length,
-            "width": box.width,
-            "height": box.height,
-        }
-        for box in free_boxes
-    ]
+    return await sync_to_async(render)(request, "boxes.html", context)
 
-    return JsonResponse({"boxes": box_data}, safe=False)
+
+def get_query_hash(request: HttpRequest) -> str:
+    """
+    Хэш параметров запроса, не зависящий от их порядка
+    """
+    query = urlencode(sorted(request.GET.items()))
+    return hashlib.md5(query.encode(), usedforsecurity=False).hexdigest()
+
+
+async def aget_boxes_etag(request: HttpRequest, storage_id: int) -> str:
+    """
+    ETag списка боксов: версия склада в кэше каталога и параметры запроса
+    """
+    version = await catalog_cache.aget_version(storage_id)
+    return f"{version}-{get_query_hash(request)}"
+
+
+def async_etag(etag_func):
+    """
+    @condition(etag_func=...) для асинхронных представлений.
+
+    Django вызывает etag_func синхронно, и чтение версии из кэша
+    блокировало бы цикл событий. Здесь etag_func - асинхронная функция
+    """
+
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            etag = quote_etag(await etag_func(request, *args, **kwargs))
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if request.method in ("GET", "HEAD") and not response.has_header("ETag"):
+                response.headers["ETag"] = etag
+            return response
+
+        return inner
+
+    return decorator
+
+
+@cache_control(private=True, no_cache=True)
+@async_etag(aget_boxes_etag)
+async def get_boxes(request: HttpRequest, storage_id: int) -> JsonResponse:
+    filter_form = BoxFilterForm(request.GET)
+    if not filter_form.is_valid():
+        return JsonResponse({"errors": filter_form.errors}, status=400)
+
+    page = await catalog_cache.aget_or_build(
+        f"boxes:{storage_id}:{filter_form.get_cache_key()}",
+        lambda: filter_form.aget_page(Box.objects.filter(storage_id=storage_id)),
+        storage_id=storage_id,
+    )
+
+    return JsonResponse(page)
+
+
+@cache_control(private=True, no_cache=True)
+@async_etag(aget_boxes_etag)
+async def get_quote(request: HttpRequest, storage_id: int) -> JsonResponse:
+    """
+    Стоимость аренды всех свободных боксов склада на период
+    start_date - end_date
+    """
+    quote_form = QuoteForm(request.GET)
+    if not quote_form.is_valid():
+        return JsonResponse({"errors": quote_form.errors}, status=400)
+
+    start_date = quote_form.cleaned_data["start_date"]
+    end_date = quote_form.cleaned_data["end_date"]
+    quote = await catalog_cache.aget_or_build(
+        f"quote:{storage_id}:{start_date.isoformat()}:{end_date.isoformat()}",
+        lambda: quote_form.aget_quote(Box.objects.filter(storage_id=storage_id)),
+        storage_id=storage_id,
+    )
+
+    return JsonResponse(quote)
+
+
+def render_static_page(request: HttpRequest, template_name: str) -> HttpResponse:
+    """
+    Страница без данных из БД.
+
+    Для анонимных посетителей страница рендерится один раз на процесс,
+    на каждый запрос в нее подставляется только CSRF-токен. Шапка страницы
+    для авторизованных пользователей зависит от пользователя, поэтому им
+    страница рендерится как обычно
+    """
+    if request.user.is_authenticated:
+        return render(request, template_name)
+
+    # Из контекста шаблонов страницам нужны только пустые формы входа
+    # и регистрации, данные запроса в общую разметку не попадают
+    html = prerender(f"page:{template_name}", template_name, auth_forms(request))
+    return HttpResponse(insert_csrf_token(html, request))
 
 
 def faq(request: HttpRequest) -> HttpResponse:
-    return render(request, "faq.html")
+    return render_static_page(request, "faq.html")
 
 
 def success_rent(request: HttpRequest) -> HttpResponse:
-    return render(request, "success_rent.html")
+    return render_static_page(request, "success_rent.html")
+
+
+def build_my_rents(user_id: int, history_form: RentHistoryForm) -> dict:
+    """
+    Аренды пользователя для личного кабинета: текущие аренды, сгруппированные
+    по складам, и страница истории
+    """
+    rents = Rent.objects.filter(user_id=user_id)
+    current_rents = []
+    if not history_form.cleaned_data.get("cursor"):
+        # Текущие аренды показываются только на первой странице, до истории.
+        # Сортировка по складу группирует их для {% regroup %} в шаблоне
+        current_rents = list(
+            rents.blocking()
+            .for_dashboard()
+            .order_by("storage_name", "storage_id", "end_date", "id")
+        )
+    return {
+        "current_rents": current_rents,
+        "history": history_form.get_page(rents.history().for_dashboard()),
+    }
 
 
 def my_rent(request: HttpRequest, user_id: int) -> HttpResponse:
     user = get_object_or_404(User, pk=user_id)
-    rents = user.rents.select_related("box", "box__storage").all()
+    history_form = RentHistoryForm(request.GET)
+    if not history_form.is_valid():
+        history_form = RentHistoryForm({})
+        history_form.is_valid()
 
-    # Группируем аренды по складам
-    grouped_rents = defaultdict(list)
-    for rent in rents:
-        storage = rent.box.storage
-        rent.is_near_end = (rent.end_date - timezone.now()) <= timedelta(days=7)
-        grouped_rents[storage].append(rent)
+    cursor = history_form.data.get("cursor") or ""
+    my_rents = catalog_cache.get_or_build(
+        f"my_rent:{user.pk}:{cursor}",
+        lambda: build_my_rents(user.pk, history_form),
+        version_key=catalog_cache.get_user_version_key(user.pk),
+    )
 
-    context = {"grouped_rents": dict(grouped_rents), "user": user}
+    context = {**my_rents, "user": user}
 
     return render(request, "my-rent.html", context)
 
 
 def show_approval(request: HttpRequest) -> HttpResponse:
-    return render(request, "approval.html")
+    return render_static_page(request, "approval.html")
+
+
+@never_cache
+def celery_metrics(request: HttpRequest) -> HttpResponse:
+    """
+    Метрики задач Celery, очередей брокера, очереди писем, обхода аренд
+    и пулов соединений с БД для Prometheus
+    """
+    if request.META.get("REMOTE_ADDR") not in settings.METRICS_ALLOWED_IPS:
+        raise PermissionDenied
+    # Celery загружается только процессом, который отдает метрики
+    from .task_metrics import (
+        get_broker_stats,
+        get_event_stats,
+        get_outbox_stats,
+        get_task_stats,
+        render_outbox_prometheus,
+        render_prometheus,
+    )
+
+    return HttpResponse(
+        render_prometheus(get_task_stats(), get_broker_stats())
+        + render_outbox_prometheus(get_outbox_stats(), get_event_stats())
+        + db_pool.render_prometheus(db_pool.get_published_pool_stats()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )